@@ -0,0 +1,49 @@
+import os
+import sys
+import logging
+
+import numpy as np
+import pandas as pd
+
+import hybe_csv_to_db as loader
+
+# Общий замер лежит в папке connectors
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from load_benchmark import run_load_benchmark  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Сравнение способов записи ('insert' и 'infile') на одних и тех же данных (см. connectors/load_benchmark.py).
+# Запуск из папки connectors/hybe с параметрами БД, заданными в hybe_csv_to_db.py:
+#     python benchmark_load_methods.py
+
+
+def make_benchmark_dataframe(rows, seed):
+    """Синтетические строки основной таблицы с уникальным натуральным ключом (воспроизводимы по seed)"""
+    rng = np.random.default_rng(seed)
+    cabinets = 10
+    days = 365
+
+    index = np.arange(rows)
+    df = pd.DataFrame({
+        'cabinet_id': 1000 + index % cabinets,
+        'campaign_key': 1 + index // (cabinets * days),
+        'date': pd.Timestamp('2024-01-01') + pd.to_timedelta(index // cabinets % days, unit='D'),
+        'impressions': rng.integers(0, 100000, rows),
+        'clicks': rng.integers(0, 5000, rows),
+        'spend_in_rub': rng.uniform(0, 50000, rows).round(2)
+    })
+    df['date'] = df['date'].dt.date
+
+    return df[loader.FACT_COLUMNS]
+
+
+def main():
+    print("HYBE.IO LOAD METHOD BENCHMARK")
+    print("=" * 50)
+
+    run_load_benchmark(loader, make_benchmark_dataframe)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,13 @@
+import os
+import json
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
 import pandas as pd
 import logging
-from typing import Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -31,6 +36,83 @@ TOKEN_URL = 'https://api.hybrid.ru/token'
 GLOBAL_DATE_FROM = 'your_start_date_here'  # Дата начала выгрузки для всех кабинетов
 GLOBAL_DATE_TO = 'your_end_date_here'  # Дата окончания (или '' для автоматического расчета до вчера)
 
+# Сколько кабинетов обрабатывается одновременно
+MAX_PARALLEL_CABINETS = 4
+
+# Параллельная выгрузка статистики по кампаниям
+# (можно переопределить для кабинета ключом 'max_concurrent_requests' в CABINETS)
+MAX_CONCURRENT_REQUESTS = 8
+
+# Размер пула HTTP-соединений (keep-alive). По умолчанию равен числу параллельных запросов кабинета,
+# можно переопределить ключом 'http_pool_size' в CABINETS
+HTTP_POOL_SIZE = None
+
+# Повторы запроса кампаний рекламодателя при построении маппинга
+ADVERTISER_LOOKUP_RETRIES = 2
+
+# Не запрашивать дневную статистику кампаний с нулевыми итогами в Campaign split
+SKIP_ZERO_ACTIVITY_CAMPAIGNS = True
+ACTIVITY_FIELDS = ['ImpressionCount', 'ClickCount', 'SumWinningPrice']
+
+# Инкрементальная выгрузка: кабинет выгружается с последней выгруженной даты
+# (с перезагрузкой RESTATEMENT_LOOKBACK_DAYS последних дней), а не с GLOBAL_DATE_FROM.
+# Если GLOBAL_DATE_FROM перенесена раньше, чем в прошлой выгрузке, период выгружается полностью с нее (дозагрузка истории)
+INCREMENTAL_MODE = True
+RESTATEMENT_LOOKBACK_DAYS = 3
+EXPORT_STATE_FILE = 'hybe_export_state.json'
+
+# Кэш маппинга кампаний на диске (JSON-файл на кабинет). Пустая строка отключает кэш
+CAMPAIGN_CACHE_DIR = 'campaign_cache'
+CAMPAIGN_CACHE_TTL_HOURS = 24
+
+
+class CampaignMappingCache:
+    """Дисковый кэш маппинга кампаний одного кабинета"""
+
+    def __init__(self, cabinet_id: int, cache_dir: str = CAMPAIGN_CACHE_DIR,
+                 ttl_hours: float = CAMPAIGN_CACHE_TTL_HOURS):
+        self.path = os.path.join(cache_dir, f'cabinet_{cabinet_id}.json')
+        self.ttl = timedelta(hours=ttl_hours)
+        # Кампании, не найденные при последнем обновлении - до истечения TTL маппинг из-за них не обновляется
+        self.unresolved_ids = set()
+
+    def load(self) -> Tuple[Dict[str, Dict], Optional[datetime]]:
+        """Загрузить маппинг и время его последнего полного обновления"""
+        if not os.path.exists(self.path):
+            return {}, None
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+            updated_at = data.get('updated_at')
+            self.unresolved_ids = set(data.get('unresolved_ids', []))
+            return data.get('campaigns', {}), datetime.fromisoformat(updated_at) if updated_at else None
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать кэш маппинга {self.path}: {e}")
+            return {}, None
+
+    def is_fresh(self, updated_at: Optional[datetime]) -> bool:
+        """Проверить, не истек ли TTL кэша"""
+        return updated_at is not None and datetime.now() - updated_at < self.ttl
+
+    def save(self, campaign_mapping: Dict[str, Dict], complete: bool = True):
+        """Сохранить маппинг (неполный маппинг сохраняется без отметки времени и будет обновлен)"""
+        data = {
+            'updated_at': datetime.now().isoformat() if complete else None,
+            'campaigns': campaign_mapping,
+            'unresolved_ids': sorted(self.unresolved_ids)
+        }
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить кэш маппинга {self.path}: {e}")
+
 
 class HybeAPIClient:
     def __init__(self, cabinet_config: Dict):
@@ -39,7 +121,23 @@ class HybeAPIClient:
         self.client_id = cabinet_config['client_id']
         self.client_secret = cabinet_config['client_secret']
         self.active = cabinet_config['active']
+        self.max_concurrent_requests = max(1, cabinet_config.get('max_concurrent_requests', MAX_CONCURRENT_REQUESTS))
         self.token = None
+        self.failed_advertisers = []
+        # Периоды запросов статистики, завершившихся ошибкой: отметка выгрузки не сдвигается дальше них
+        self.failed_periods = []
+        # Последнее построение маппинга прошло без ошибок (список рекламодателей и кампании всех рекламодателей)
+        self.mapping_complete = False
+        self.mapping_cache = CampaignMappingCache(self.cabinet_id) if CAMPAIGN_CACHE_DIR else None
+        self.mapping_refreshed = False
+        self.mapping_cache_fresh = False
+
+        pool_size = cabinet_config.get('http_pool_size', HTTP_POOL_SIZE) or self.max_concurrent_requests
+        self.session = create_http_session(pool_size)
+
+    def close(self):
+        """Закрыть HTTP-сессию и освободить соединения пула"""
+        self.session.close()
 
     def get_access_token(self) -> str:
         """Получение access_token для Hybe.io API"""
@@ -55,46 +153,52 @@ class HybeAPIClient:
         }
 
         try:
-            resp = requests.post(TOKEN_URL, headers=headers, data=data, timeout=30)
+            resp = self.session.post(TOKEN_URL, headers=headers, data=data, timeout=30)
             resp.raise_for_status()
             self.token = resp.json()['access_token']
+            # Токен передается во всех последующих запросах через заголовки сессии
+            self.session.headers['Authorization'] = f'Bearer {self.token}'
             logger.info(f"Токен для кабинета {self.cabinet_name} получен")
             return self.token
         except Exception as e:
             logger.error(f"Ошибка получения токена для {self.cabinet_name}: {e}")
             return None
 
-    def get_advertisers_list(self) -> List[Dict]:
-        """Получить список рекламодателей"""
+    def get_advertisers_list(self) -> Optional[List[Dict]]:
+        """Получить список рекламодателей (None - если запрос завершился ошибкой)"""
         if not self.token:
             return []
 
         url = 'https://api.hybrid.ru/v3.0/agency/advertisers'
-        headers = {'Authorization': f'Bearer {self.token}'}
 
         try:
-            resp = requests.get(url, headers=headers, timeout=30)
+            resp = self.session.get(url, timeout=30)
             resp.raise_for_status()
             return resp.json()
         except Exception as e:
             logger.error(f"Ошибка получения рекламодателей для {self.cabinet_name}: {e}")
-            return []
+            return None
 
-    def get_campaigns_by_advertiser(self, advertiser_id: str) -> List[Dict]:
-        """Получить список кампаний для рекламодателя"""
+    def get_campaigns_by_advertiser(self, advertiser_id: str) -> Optional[List[Dict]]:
+        """Получить список кампаний для рекламодателя (None - если запрос завершился ошибкой)"""
         if not self.token:
             return []
 
         url = f'https://api.hybrid.ru/v3.0/advertiser/campaigns?advertiserId={advertiser_id}'
-        headers = {'Authorization': f'Bearer {self.token}'}
 
         try:
-            resp = requests.get(url, headers=headers, timeout=30)
+            resp = self.session.get(url, timeout=30)
             resp.raise_for_status()
             return resp.json()
         except Exception as e:
             logger.warning(f"Ошибка получения кампаний для рекламодателя {advertiser_id}: {e}")
-            return []
+            return None
+
+    def lookup_advertiser_campaigns(self, advertiser: Dict) -> Tuple[Optional[List[Dict]], float]:
+        """Получить кампании рекламодателя вместе со временем выполнения запроса"""
+        started = time.monotonic()
+        campaigns = self.get_campaigns_by_advertiser(advertiser.get('Id'))
+        return campaigns, time.monotonic() - started
 
     def build_campaign_mapping(self) -> Dict[str, Dict]:
         """Построение маппинга ID кампаний к их названиям и рекламодателям"""
@@ -103,25 +207,74 @@ class HybeAPIClient:
 
         logger.info(f"Строим маппинг кампаний для {self.cabinet_name}")
         campaign_mapping = {}
+        self.failed_advertisers = []
+        self.mapping_complete = False
 
         try:
             advertisers = self.get_advertisers_list()
+            if advertisers is None:
+                return campaign_mapping
+
             logger.info(f"Найдено рекламодателей: {len(advertisers)}")
 
-            for advertiser in advertisers:
-                advertiser_id = advertiser.get('Id')
-                advertiser_name = advertiser.get('Name', 'Unknown Advertiser')
+            if not advertisers:
+                self.mapping_complete = True
+                return campaign_mapping
+
+            started = time.monotonic()
+            pending = advertisers
+            timings = []
+
+            # Запрашиваем кампании рекламодателей параллельно, неудачные запросы повторяем
+            for attempt in range(ADVERTISER_LOOKUP_RETRIES + 1):
+                failed = []
+                max_workers = min(self.max_concurrent_requests, len(pending))
 
-                campaigns = self.get_campaigns_by_advertiser(advertiser_id)
-                for campaign in campaigns:
-                    campaign_id = campaign.get('Id')
-                    campaign_name = campaign.get('Name', f'Campaign_{campaign_id}')
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    results = list(executor.map(self.lookup_advertiser_campaigns, pending))
 
-                    if campaign_id:
-                        campaign_mapping[campaign_id] = {
-                            'real_name': campaign_name,
-                            'advertiser_name': advertiser_name
-                        }
+                for advertiser, (campaigns, elapsed) in zip(pending, results):
+                    advertiser_id = advertiser.get('Id')
+                    advertiser_name = advertiser.get('Name', 'Unknown Advertiser')
+
+                    if campaigns is None:
+                        failed.append(advertiser)
+                        continue
+
+                    timings.append((elapsed, advertiser_name))
+                    logger.info(f"Рекламодатель {advertiser_name}: {len(campaigns)} кампаний за {elapsed:.2f}с")
+
+                    for campaign in campaigns:
+                        campaign_id = campaign.get('Id')
+                        campaign_name = campaign.get('Name', f'Campaign_{campaign_id}')
+
+                        if campaign_id:
+                            campaign_mapping[campaign_id] = {
+                                'real_name': campaign_name,
+                                'advertiser_id': advertiser_id,
+                                'advertiser_name': advertiser_name
+                            }
+
+                if not failed:
+                    break
+
+                if attempt < ADVERTISER_LOOKUP_RETRIES:
+                    logger.warning(f"⚠️ Не удалось получить кампании для {len(failed)} рекламодателей, "
+                                   f"повтор {attempt + 1}/{ADVERTISER_LOOKUP_RETRIES}")
+                pending = failed
+
+            self.failed_advertisers = failed
+            self.mapping_complete = not failed
+
+            if failed:
+                failed_names = ', '.join(f"{a.get('Name', 'Unknown Advertiser')} ({a.get('Id')})" for a in failed)
+                logger.error(f"❌ Кампании не получены для {len(failed)} рекламодателей в {self.cabinet_name}: "
+                             f"{failed_names}. Их кампании будут выгружены без названий")
+
+            if timings:
+                slowest_time, slowest_name = max(timings, key=lambda t: t[0])
+                logger.info(f"Маппинг построен за {time.monotonic() - started:.2f}с, "
+                            f"самый долгий рекламодатель: {slowest_name} ({slowest_time:.2f}с)")
 
             logger.info(f"Собрано {len(campaign_mapping)} кампаний")
             return campaign_mapping
@@ -130,6 +283,58 @@ class HybeAPIClient:
             logger.error(f"Ошибка построения маппинга для {self.cabinet_name}: {e}")
             return {}
 
+    def get_campaign_mapping(self) -> Dict[str, Dict]:
+        """Получить маппинг кампаний из кэша, а при отсутствии или истечении TTL - построить заново"""
+        if self.mapping_cache is None:
+            # Маппинг только что построен: повторное построение в refresh_campaign_mapping ничего не добавит
+            campaign_mapping = self.build_campaign_mapping()
+            self.mapping_refreshed = True
+            return campaign_mapping
+
+        campaign_mapping, updated_at = self.mapping_cache.load()
+
+        if campaign_mapping and self.mapping_cache.is_fresh(updated_at):
+            self.mapping_cache_fresh = True
+            logger.info(f"Маппинг кампаний для {self.cabinet_name} загружен из кэша: {len(campaign_mapping)} кампаний")
+            return campaign_mapping
+
+        fresh_mapping = self.build_campaign_mapping()
+        self.mapping_refreshed = True
+
+        if not fresh_mapping:
+            return campaign_mapping
+
+        # Записи устаревшего кэша остаются для кампаний, которых нет в новом маппинге
+        campaign_mapping.update(fresh_mapping)
+        self.mapping_cache.unresolved_ids.clear()
+        self.mapping_cache.save(campaign_mapping, complete=self.mapping_complete)
+        return campaign_mapping
+
+    def refresh_campaign_mapping(self, campaign_mapping: Dict[str, Dict], missing_ids: List[str]):
+        """Дообновить маппинг, если в статистике встретились кампании, которых нет в кэше"""
+        if self.mapping_cache is not None and self.mapping_cache_fresh:
+            missing_ids = [cid for cid in missing_ids if cid not in self.mapping_cache.unresolved_ids]
+
+        if not missing_ids:
+            return
+
+        # API не отдает кампанию по ID без рекламодателя, поэтому маппинг обновляется не чаще раза за запуск
+        if not self.mapping_refreshed:
+            logger.info(f"В маппинге нет {len(missing_ids)} кампаний, обновляем маппинг для {self.cabinet_name}")
+            self.mapping_refreshed = True
+            campaign_mapping.update(self.build_campaign_mapping())
+
+        still_missing = [cid for cid in missing_ids if cid not in campaign_mapping]
+
+        # Пустой маппинг (обновление не удалось, кэша нет) не записывается поверх кэша
+        if self.mapping_cache is not None and campaign_mapping:
+            self.mapping_cache.unresolved_ids.update(still_missing)
+            # Неполное обновление не продлевает TTL: маппинг будет перестроен при следующем запуске
+            self.mapping_cache.save(campaign_mapping, complete=self.mapping_complete)
+
+        if still_missing:
+            logger.warning(f"⚠️ Кампании не найдены в маппинге {self.cabinet_name}: {len(still_missing)}")
+
     def get_agency_statistics(self, date_from: str, date_to: str, split: str = 'Day',
                               page: int = 0, limit: int = 100) -> Dict:
         """Получить статистику агентства"""
@@ -146,20 +351,21 @@ class HybeAPIClient:
             split = 'Day'
 
         url = f'https://api.hybrid.ru/v3.0/agency/{split}?from={date_from}&to={date_to}&page={page}&limit={limit}'
-        headers = {'Authorization': f'Bearer {self.token}'}
 
         try:
             logger.info(f"Запрос к API: {url}")
-            resp = requests.get(url, headers=headers, timeout=30)
+            resp = self.session.get(url, timeout=30)
             resp.raise_for_status()
             return resp.json()
         except requests.exceptions.HTTPError as e:
             logger.error(f"HTTP ошибка {e.response.status_code}: {e}")
             if e.response.status_code == 400:
                 logger.error(f"Ответ сервера: {e.response.text}")
+            self.failed_periods.append((date_from, date_to))
             return {}
         except Exception as e:
             logger.error(f"Ошибка получения статистики агентства: {e}")
+            self.failed_periods.append((date_from, date_to))
             return {}
 
     def get_campaign_statistics(self, date_from: str, date_to: str, campaign_id: str,
@@ -178,19 +384,20 @@ class HybeAPIClient:
             split = 'Day'
 
         url = f'https://api.hybrid.ru/v3.0/campaign/{split}?from={date_from}&to={date_to}&campaignId={campaign_id}&page={page}&limit={limit}'
-        headers = {'Authorization': f'Bearer {self.token}'}
 
         try:
-            resp = requests.get(url, headers=headers, timeout=30)
+            resp = self.session.get(url, timeout=30)
             resp.raise_for_status()
             return resp.json()
         except requests.exceptions.HTTPError as e:
             logger.warning(f"HTTP ошибка {e.response.status_code} для кампании {campaign_id}: {e}")
             if e.response.status_code == 400:
                 logger.warning(f"Ответ сервера: {e.response.text}")
+            self.failed_periods.append((date_from, date_to))
             return {}
         except Exception as e:
             logger.warning(f"Ошибка получения статистики кампании {campaign_id}: {e}")
+            self.failed_periods.append((date_from, date_to))
             return {}
 
     def get_detailed_statistics(self, date_from: str, date_to: str, campaign_mapping: Dict[str, Dict]) -> List[Dict]:
@@ -226,62 +433,112 @@ class HybeAPIClient:
 
             logger.info(f"✓ Найдено кампаний в Campaign split: {len(campaigns_stats['Statistic'])}")
 
-            # Собираем уникальные ID кампаний из Campaign split
+            # Собираем уникальные ID кампаний из Campaign split и отмечаем кампании с активностью
             campaign_ids = []
+            active_ids = set()
             for stat in campaigns_stats['Statistic']:
                 campaign_id = stat.get('CampaignId')
                 if campaign_id:
                     campaign_ids.append(campaign_id)
+                    if campaign_has_activity(stat):
+                        active_ids.add(campaign_id)
 
-            campaign_ids = list(set(campaign_ids))  # убираем дубликаты
+            campaign_ids = sorted(set(campaign_ids))  # убираем дубликаты, фиксируем порядок
             logger.info(f"📋 Уникальных кампаний: {len(campaign_ids)}")
 
+            # Пропускаем кампании без показов, кликов и расходов за период - по ним нет дневной статистики
+            if SKIP_ZERO_ACTIVITY_CAMPAIGNS:
+                skipped_count = len(campaign_ids) - len(active_ids)
+                campaign_ids = [cid for cid in campaign_ids if cid in active_ids]
+                if skipped_count:
+                    logger.info(f"⏭️ Пропущено кампаний без активности: {skipped_count}")
+                if skipped_count and not campaign_ids:
+                    logger.info(f"Нет кампаний с активностью за период для {self.cabinet_name}")
+                    return []
+
             if not campaign_ids:
                 logger.warning(f"❌ Не найдено ID кампаний в ответе API для {self.cabinet_name}")
                 return []
 
-            # Получаем детальную статистику по дням для каждой кампании
-            all_detailed_stats = []
-
-            for i, campaign_id in enumerate(campaign_ids):
-                # Определяем название кампании и рекламодателя
-                if campaign_id in campaign_mapping:
-                    campaign_name = campaign_mapping[campaign_id]['real_name']
-                    advertiser_name = campaign_mapping[campaign_id]['advertiser_name']
-                else:
-                    campaign_name = f"Campaign_{campaign_id[-8:]}"
-                    advertiser_name = "Unknown Advertiser"
+            # Обновляем маппинг только если встретились кампании, которых в нем нет
+            missing_ids = [cid for cid in campaign_ids if cid not in campaign_mapping]
+            self.refresh_campaign_mapping(campaign_mapping, missing_ids)
 
-                if (i + 1) % 5 == 0:
-                    logger.info(f"🔄 Обработано: {i + 1}/{len(campaign_ids)} кампаний")
+            # Получаем детальную статистику по дням для каждой кампании параллельно
+            max_workers = min(self.max_concurrent_requests, len(campaign_ids))
+            logger.info(f"🚀 Параллельных запросов: {max_workers}")
 
-                # Получаем статистику по дням для этой кампании
-                campaign_daily_stats = self.get_campaign_statistics(
-                    date_from, date_to, campaign_id, split='Day', limit=1000
-                )
+            all_detailed_stats = []
 
-                if campaign_daily_stats and campaign_daily_stats.get('Statistic'):
-                    logger.info(f"✓ Кампания {campaign_name}: {len(campaign_daily_stats['Statistic'])} записей")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(self.fetch_campaign_daily_stats, date_from, date_to, campaign_id, campaign_mapping)
+                    for campaign_id in campaign_ids
+                ]
 
-                    # Добавляем информацию о кампании и кабинете к каждой записи
-                    for stat in campaign_daily_stats['Statistic']:
-                        stat['CampaignId'] = campaign_id
-                        stat['CampaignName'] = campaign_name
-                        stat['AdvertiserName'] = advertiser_name
-                        stat['CabinetId'] = self.cabinet_id
-                        stat['CabinetName'] = self.cabinet_name
+                # Собираем результаты в порядке кампаний, а не в порядке завершения запросов
+                for i, future in enumerate(futures):
+                    all_detailed_stats.extend(future.result())
 
-                    all_detailed_stats.extend(campaign_daily_stats['Statistic'])
-                else:
-                    logger.warning(f"⚠️ Нет данных для кампании {campaign_name}")
+                    if (i + 1) % 5 == 0:
+                        logger.info(f"🔄 Обработано: {i + 1}/{len(campaign_ids)} кампаний")
 
             logger.info(f"✅ Собрано {len(all_detailed_stats)} записей для {self.cabinet_name}")
             return all_detailed_stats
 
         except Exception as e:
             logger.error(f"❌ Ошибка получения данных для {self.cabinet_name}: {e}")
+            self.failed_periods.append((date_from, date_to))
             return []
 
+    def fetch_campaign_daily_stats(self, date_from: str, date_to: str, campaign_id: str,
+                                   campaign_mapping: Dict[str, Dict]) -> List[Dict]:
+        """Получить статистику по дням для одной кампании с названиями кампании и рекламодателя"""
+        # Определяем название кампании и рекламодателя
+        if campaign_id in campaign_mapping:
+            campaign_name = campaign_mapping[campaign_id]['real_name']
+            # В кэше маппинга, сохраненном до появления advertiser_id, поля может не быть
+            advertiser_id = campaign_mapping[campaign_id].get('advertiser_id')
+            advertiser_name = campaign_mapping[campaign_id]['advertiser_name']
+        else:
+            campaign_name = f"Campaign_{campaign_id[-8:]}"
+            advertiser_id = None
+            advertiser_name = "Unknown Advertiser"
+
+        try:
+            campaign_daily_stats = self.get_campaign_statistics(
+                date_from, date_to, campaign_id, split='Day', limit=1000
+            )
+        except Exception as e:
+            logger.warning(f"Ошибка получения статистики кампании {campaign_id}: {e}")
+            self.failed_periods.append((date_from, date_to))
+            return []
+
+        if not campaign_daily_stats or not campaign_daily_stats.get('Statistic'):
+            logger.warning(f"⚠️ Нет данных для кампании {campaign_name}")
+            return []
+
+        logger.info(f"✓ Кампания {campaign_name}: {len(campaign_daily_stats['Statistic'])} записей")
+
+        # Добавляем информацию о кампании и кабинете к каждой записи
+        for stat in campaign_daily_stats['Statistic']:
+            stat['CampaignId'] = campaign_id
+            stat['CampaignName'] = campaign_name
+            stat['AdvertiserId'] = advertiser_id
+            stat['AdvertiserName'] = advertiser_name
+            stat['CabinetId'] = self.cabinet_id
+            stat['CabinetName'] = self.cabinet_name
+
+        return campaign_daily_stats['Statistic']
+
+    def get_watermark_limit(self) -> Optional[str]:
+        """Последняя дата перед первым периодом с ошибкой запроса или None, если ошибок не было"""
+        if not self.failed_periods:
+            return None
+
+        first_failed = min(date_from for date_from, _ in self.failed_periods)
+        return (datetime.strptime(first_failed, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+
     def get_statistics_by_chunks(self, date_from: str, date_to: str, campaign_mapping: Dict[str, Dict],
                                  chunk_days: int = 89) -> List[Dict]:
         """Получение статистики по частям (для периодов больше 90 дней)"""
@@ -309,6 +566,7 @@ class HybeAPIClient:
                     logger.warning(f"⚠️ Часть {chunk_number}: нет данных")
             except Exception as e:
                 logger.error(f"❌ Ошибка для части {chunk_number} ({chunk_from} - {chunk_to}): {e}")
+                self.failed_periods.append((chunk_from, chunk_to))
 
             current_date = chunk_end + timedelta(days=1)
             chunk_number += 1
@@ -317,6 +575,33 @@ class HybeAPIClient:
         return all_data
 
 
+def campaign_has_activity(stat: Dict) -> bool:
+    """Проверить, есть ли у кампании показы, клики или расходы в итогах Campaign split"""
+    values = [stat.get(field) for field in ACTIVITY_FIELDS if stat.get(field) is not None]
+
+    # Если итогов в ответе нет, считаем кампанию активной, чтобы не потерять данные
+    if not values:
+        return True
+
+    for value in values:
+        try:
+            if float(value) > 0:
+                return True
+        except (TypeError, ValueError):
+            return True
+
+    return False
+
+
+def create_http_session(pool_size: int) -> requests.Session:
+    """Создать HTTP-сессию с пулом keep-alive соединений заданного размера"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
 def convert_date_format(date_str: str, from_format: str, to_format: str) -> str:
     """Конвертация формата даты"""
     try:
@@ -338,6 +623,7 @@ def prepare_dataframe(raw_data: List[Dict]) -> pd.DataFrame:
     df_final = pd.DataFrame()
     df_final['cabinet_id'] = df.get('CabinetId', 0)
     df_final['cabinet_name'] = df.get('CabinetName', 'Unknown Cabinet')
+    df_final['advertiser_id'] = df.get('AdvertiserId')
     df_final['advertiser_name'] = df.get('AdvertiserName', 'Unknown Advertiser')
     df_final['campaign_name'] = df.get('CampaignName', 'Unknown Campaign')
     df_final['campaign_id'] = df.get('CampaignId', 'Unknown ID')
@@ -363,8 +649,76 @@ def prepare_dataframe(raw_data: List[Dict]) -> pd.DataFrame:
     return df_final
 
 
-def process_cabinet(cabinet_config: Dict) -> pd.DataFrame:
-    """Обработка данных одного кабинета"""
+def load_export_state() -> Dict:
+    """Загрузить состояние выгрузки: начало периода прошлой выгрузки и последние выгруженные даты кабинетов"""
+    empty_state = {'date_from': None, 'last_dates': {}}
+    if not os.path.exists(EXPORT_STATE_FILE):
+        return empty_state
+
+    try:
+        with open(EXPORT_STATE_FILE, 'r', encoding='utf-8') as f:
+            export_state = json.load(f)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать состояние выгрузки {EXPORT_STATE_FILE}: {e}")
+        return empty_state
+
+    # Старый формат состояния - только последние даты кабинетов
+    if 'last_dates' not in export_state:
+        return {'date_from': None, 'last_dates': export_state}
+
+    return export_state
+
+
+def advance_last_dates(last_dates: Dict[str, str], df: pd.DataFrame,
+                       watermark_limits: Dict[str, str]) -> Dict[str, str]:
+    """Новые последние выгруженные даты кабинетов по выгруженным данным.
+
+    watermark_limits - последняя дата перед первым периодом с ошибкой: отметка кабинета ставится не дальше нее
+    (в том числе откатывается назад), чтобы период с ошибкой попал в следующий инкрементальный запуск
+    """
+    new_last_dates = dict(last_dates)
+
+    if df.empty:
+        return new_last_dates
+
+    for cabinet_id, max_date in df.groupby('cabinet_id')['date'].max().items():
+        key = str(cabinet_id)
+        limit = watermark_limits.get(key)
+
+        if limit is not None:
+            new_last_dates[key] = min(max_date, limit)
+        elif max_date > new_last_dates.get(key, ''):
+            # Дата только растет - перевыгрузка старого периода не откатывает отметку
+            new_last_dates[key] = max_date
+
+    return new_last_dates
+
+
+def save_export_state(export_state: Dict):
+    """Сохранить состояние выгрузки"""
+    try:
+        tmp_path = f'{EXPORT_STATE_FILE}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(export_state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, EXPORT_STATE_FILE)
+        logger.info(f"Состояние выгрузки сохранено в {EXPORT_STATE_FILE}")
+    except Exception as e:
+        logger.error(f"Ошибка сохранения состояния выгрузки: {e}")
+
+
+def get_incremental_start_date(cabinet_id: int, api_date_from: str, last_dates: Dict[str, str]) -> str:
+    """Начало периода кабинета: день после последней выгруженной даты минус окно перезагрузки"""
+    last_date = last_dates.get(str(cabinet_id))
+    if not last_date:
+        return api_date_from
+
+    start = datetime.strptime(last_date, '%Y-%m-%d') + timedelta(days=1 - RESTATEMENT_LOOKBACK_DAYS)
+    return max(start.strftime('%Y-%m-%d'), api_date_from)
+
+
+def process_cabinet(cabinet_config: Dict,
+                    last_dates: Optional[Dict[str, str]] = None) -> Tuple[pd.DataFrame, Optional[str]]:
+    """Обработка данных одного кабинета; вернуть (DataFrame, последняя дата перед первым периодом с ошибкой или None)"""
     cabinet_name = cabinet_config['cabinet_name']
 
     logger.info(f"Обрабатываем кабинет: {cabinet_name}")
@@ -372,23 +726,16 @@ def process_cabinet(cabinet_config: Dict) -> pd.DataFrame:
     # Проверяем активность кабинета
     if not cabinet_config.get('active', True):
         logger.warning(f"Кабинет {cabinet_name} отключен")
-        return pd.DataFrame()
+        return pd.DataFrame(), None
 
     # Проверяем наличие учетных данных
     if not cabinet_config.get('client_id') or not cabinet_config.get('client_secret'):
         logger.error(f"Не указаны CLIENT_ID/CLIENT_SECRET для {cabinet_name}")
-        return pd.DataFrame()
+        return pd.DataFrame(), None
 
-    try:
-        # Инициализация клиента API
-        client = HybeAPIClient(cabinet_config)
-
-        # Получаем токен
-        token = client.get_access_token()
-        if not token:
-            logger.error(f"Не удалось получить токен для {cabinet_name}")
-            return pd.DataFrame()
+    client = None
 
+    try:
         # Используем глобальные настройки периода для всех кабинетов
         start_date = GLOBAL_DATE_FROM
 
@@ -405,46 +752,72 @@ def process_cabinet(cabinet_config: Dict) -> pd.DataFrame:
         api_date_from = convert_date_format(start_date, '%d.%m.%Y', '%Y-%m-%d')
         api_date_to = convert_date_format(end_date, '%d.%m.%Y', '%Y-%m-%d')
 
+        # В инкрементальном режиме начинаем с последней выгруженной даты кабинета
+        if INCREMENTAL_MODE and last_dates:
+            api_date_from = get_incremental_start_date(cabinet_config['cabinet_id'], api_date_from, last_dates)
+
+            if api_date_from > api_date_to:
+                logger.info(f"Нет новых дней для выгрузки по {cabinet_name}")
+                return pd.DataFrame(), None
+
         logger.info(f"API период для {cabinet_name}: {api_date_from} - {api_date_to}")
 
-        # Строим маппинг кампаний
-        campaign_mapping = client.build_campaign_mapping()
+        # Инициализация клиента API
+        client = HybeAPIClient(cabinet_config)
+
+        # Получаем токен
+        token = client.get_access_token()
+        if not token:
+            logger.error(f"Не удалось получить токен для {cabinet_name}")
+            return pd.DataFrame(), None
+
+        # Получаем маппинг кампаний (из кэша или строим заново)
+        campaign_mapping = client.get_campaign_mapping()
 
         # Получаем данные
         raw_data = client.get_detailed_statistics(api_date_from, api_date_to, campaign_mapping)
 
+        # Отметка кабинета не должна перескочить период, по которому запрос завершился ошибкой
+        watermark_limit = client.get_watermark_limit()
+        if watermark_limit is not None:
+            logger.warning(f"Запросов с ошибкой для {cabinet_name}: {len(client.failed_periods)}, "
+                           f"отметка выгрузки не сдвинется дальше {watermark_limit}")
+
         if raw_data:
             # Подготавливаем DataFrame
             df = prepare_dataframe(raw_data)
 
             if not df.empty:
                 logger.info(f"Получено данных для {cabinet_name}: {len(df)} записей")
-                return df
+                return df, watermark_limit
             else:
                 logger.warning(f"Нет данных для {cabinet_name}")
-                return pd.DataFrame()
+                return pd.DataFrame(), watermark_limit
         else:
             logger.warning(f"Не удалось получить данные для {cabinet_name}")
-            return pd.DataFrame()
+            return pd.DataFrame(), watermark_limit
 
     except Exception as e:
         logger.error(f"Ошибка обработки {cabinet_name}: {e}")
-        return pd.DataFrame()
+        return pd.DataFrame(), None
 
+    finally:
+        if client is not None:
+            client.close()
 
-def main():
-    print("HYBE.IO DATA EXPORT TO CSV")
-    print("=" * 50)
 
+def export_data():
+    """Выгрузить данные всех активных кабинетов; вернуть (DataFrame, новое состояние выгрузки для сохранения после загрузки)
+    или (None, None) при ошибке настроек"""
     # Проверка конфигурации кабинетов
     if not CABINETS:
         logger.error("Не настроен ни один кабинет!")
-        return
+        return None, None
 
     active_cabinets = [c for c in CABINETS if c.get('active', True)]
     if not active_cabinets:
         logger.error("Нет активных кабинетов!")
-        return
+        return None, None
 
     logger.info(f"Активных кабинетов: {len(active_cabinets)}")
 
@@ -462,38 +835,93 @@ def main():
 
     except ValueError:
         logger.error(f"Неверный формат глобальных дат! Используйте DD.MM.YYYY")
-        return
+        return None, None
 
-    # Обработка каждого кабинета
+    api_date_from = convert_date_format(GLOBAL_DATE_FROM, '%d.%m.%Y', '%Y-%m-%d')
+
+    # Последние выгруженные даты кабинетов для инкрементальной выгрузки
+    export_state = load_export_state() if INCREMENTAL_MODE else {'date_from': None, 'last_dates': {}}
+    last_dates = export_state['last_dates']
+
+    # Явно перенесенная раньше GLOBAL_DATE_FROM важнее отметок: история дозагружается с нее
+    if last_dates and export_state['date_from'] and api_date_from < export_state['date_from']:
+        logger.info(f"GLOBAL_DATE_FROM раньше начала прошлой выгрузки ({export_state['date_from']}): "
+                    f"выгружаем весь период без учета отметок")
+        last_dates = {}
+
+    if last_dates:
+        logger.info(f"Инкрементальный режим: перезагружаем последние {RESTATEMENT_LOOKBACK_DAYS} дн.")
+
+    # Обработка кабинетов параллельно, ошибка одного кабинета не влияет на остальные
     all_dataframes = []
+    watermark_limits = {}
+    max_workers = min(MAX_PARALLEL_CABINETS, len(active_cabinets))
+    logger.info(f"Параллельно обрабатываемых кабинетов: {max_workers}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process_cabinet, cabinet_config, last_dates)
+                   for cabinet_config in active_cabinets]
+
+        # Результаты объединяем в порядке CABINETS
+        for cabinet_config, future in zip(active_cabinets, futures):
+            try:
+                df, watermark_limit = future.result()
+            except Exception as e:
+                logger.error(f"Ошибка обработки {cabinet_config['cabinet_name']}: {e}")
+                continue
+
+            if watermark_limit is not None:
+                watermark_limits[str(cabinet_config['cabinet_id'])] = watermark_limit
 
-    for cabinet_config in CABINETS:
-        if cabinet_config.get('active', True):
-            df = process_cabinet(cabinet_config)
             if not df.empty:
                 all_dataframes.append(df)
 
     # Объединяем все данные
-    if all_dataframes:
-        final_df = pd.concat(all_dataframes, ignore_index=True)
+    final_df = pd.concat(all_dataframes, ignore_index=True) if all_dataframes else pd.DataFrame()
+
+    new_state = {
+        'date_from': api_date_from,
+        'last_dates': advance_last_dates(last_dates, final_df, watermark_limits)
+    }
+    return final_df, new_state
 
-        # Сохраняем в CSV
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'hybe_data_{timestamp}.csv'
 
-        final_df.to_csv(filename, index=False, encoding='utf-8')
+def save_to_csv(final_df: pd.DataFrame) -> str:
+    """Сохранить выгрузку в CSV; вернуть имя файла"""
+    # Сохраняем в CSV
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f'hybe_data_{timestamp}.csv'
 
-        logger.info(f"Данные сохранены в файл: {filename}")
-        logger.info(f"Всего записей: {len(final_df)}")
-        logger.info(f"Уникальных кампаний: {final_df['campaign_name'].nunique()}")
-        logger.info(f"Период данных: {final_df['date'].min()} - {final_df['date'].max()}")
-        logger.info(f"Всего показов: {final_df['impressions'].sum():,}")
-        logger.info(f"Всего кликов: {final_df['clicks'].sum():,}")
-        logger.info(f"Общие расходы: {final_df['spend_in_rub'].sum():,.2f} руб.")
+    final_df.to_csv(filename, index=False, encoding='utf-8')
 
-    else:
+    logger.info(f"Данные сохранены в файл: {filename}")
+    logger.info(f"Всего записей: {len(final_df)}")
+    logger.info(f"Уникальных кампаний: {final_df['campaign_name'].nunique()}")
+    logger.info(f"Период данных: {final_df['date'].min()} - {final_df['date'].max()}")
+    logger.info(f"Всего показов: {final_df['impressions'].sum():,}")
+    logger.info(f"Всего кликов: {final_df['clicks'].sum():,}")
+    logger.info(f"Общие расходы: {final_df['spend_in_rub'].sum():,.2f} руб.")
+
+    return filename
+
+
+def main():
+    print("HYBE.IO DATA EXPORT TO CSV")
+    print("=" * 50)
+
+    final_df, export_state = export_data()
+    if final_df is None:
+        return
+
+    if final_df.empty:
         logger.error("Нет данных для сохранения")
+        return
+
+    save_to_csv(final_df)
+
+    if INCREMENTAL_MODE:
+        save_export_state(export_state)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,75 @@
+import time
+import logging
+import statistics
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Общий замер способов записи ('insert' и 'infile') для коннекторов; данные для замера готовит сам коннектор
+# (см. benchmark_load_methods.py в папке коннектора). Для 'infile' на сервере должен быть включен local_infile=1.
+# Запись идет в отдельную таблицу с той же схемой и индексами, что и основная (как запись в промежуточную
+# таблицу при USE_STAGING_TABLE - без upsert); основная таблица не меняется.
+# Партиции пишутся напрямую через write_partition, без параллельной записи: сравниваются сами способы записи,
+# а не число соединений
+BENCHMARK_ROWS = 200000
+BENCHMARK_REPEATS = 3
+BENCHMARK_METHODS = ['insert', 'infile']
+BENCHMARK_SEED = 42
+
+
+def run_benchmark(db_manager, df, table, method):
+    """Записать df выбранным способом BENCHMARK_REPEATS раз в пустую таблицу; вернуть время каждой записи"""
+    timings = []
+
+    for repeat in range(1, BENCHMARK_REPEATS + 1):
+        with db_manager.engine.begin() as connection:
+            connection.execute(text(f"TRUNCATE TABLE {table}"))
+
+        started = time.monotonic()
+        db_manager.write_partition(df, table, method)
+        elapsed = time.monotonic() - started
+        timings.append(elapsed)
+
+        logger.info(f"{method}: попытка {repeat}/{BENCHMARK_REPEATS}, {elapsed:.2f}с, "
+                    f"{len(df) / max(elapsed, 0.001):,.0f} записей/с")
+
+    return timings
+
+
+def run_load_benchmark(loader, make_dataframe):
+    """Сравнить способы записи на данных make_dataframe(rows, seed) в копии основной таблицы модуля loader"""
+    benchmark_table = f'{loader.TABLE}_benchmark'
+
+    # local_infile включается при создании движка, поэтому менеджер создается для 'infile'
+    db_manager = loader.prepare_database('infile')
+    if db_manager is None:
+        return
+
+    df = make_dataframe(BENCHMARK_ROWS, BENCHMARK_SEED)
+    logger.info(f"Тестовых записей: {len(df)}, повторов: {BENCHMARK_REPEATS}, таблица: {benchmark_table}")
+
+    with db_manager.engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS {benchmark_table}"))
+        connection.execute(text(f"CREATE TABLE {benchmark_table} LIKE {loader.TABLE}"))
+
+    results = {}
+    try:
+        for method in BENCHMARK_METHODS:
+            try:
+                results[method] = run_benchmark(db_manager, df, benchmark_table, method)
+            except Exception as e:
+                logger.error(f"❌ Способ {method} завершился ошибкой: {e}")
+
+    finally:
+        with db_manager.engine.begin() as connection:
+            connection.execute(text(f"DROP TABLE IF EXISTS {benchmark_table}"))
+
+    logger.info("📊 РЕЗУЛЬТАТЫ (медиана по повторам):")
+    for method, timings in results.items():
+        median = statistics.median(timings)
+        logger.info(f"  {method}: {median:.2f}с, {len(df) / max(median, 0.001):,.0f} записей/с")
+
+    if len(results) == len(BENCHMARK_METHODS):
+        speedup = statistics.median(results['insert']) / max(statistics.median(results['infile']), 0.001)
+        logger.info(f"  infile быстрее insert в {speedup:.1f} раз")
@@ -0,0 +1,49 @@
+import os
+import sys
+import logging
+
+import numpy as np
+import pandas as pd
+
+import mintegral_csv_to_db as loader
+
+# Общий замер лежит в папке connectors
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from load_benchmark import run_load_benchmark  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Сравнение способов записи ('insert' и 'infile') на одних и тех же данных (см. connectors/load_benchmark.py).
+# Запуск из папки connectors/mintegral с параметрами БД, заданными в mintegral_csv_to_db.py:
+#     python benchmark_load_methods.py
+
+
+def make_benchmark_dataframe(rows, seed):
+    """Синтетические строки основной таблицы с уникальным натуральным ключом (воспроизводимы по seed)"""
+    rng = np.random.default_rng(seed)
+    accounts = 10
+    days = 365
+
+    index = np.arange(rows)
+    df = pd.DataFrame({
+        'account_id': 1000 + index % accounts,
+        'date': pd.Timestamp('2024-01-01') + pd.to_timedelta(index // accounts % days, unit='D'),
+        'campaign_key': 1 + index // (accounts * days),
+        'impression': rng.integers(0, 100000, rows),
+        'clicks': rng.integers(0, 5000, rows),
+        'spend_in_dollars': rng.uniform(0, 500, rows).round(4)
+    })
+    df['date'] = df['date'].dt.date
+
+    return df[loader.FACT_COLUMNS]
+
+
+def main():
+    print("MINTEGRAL LOAD METHOD BENCHMARK")
+    print("=" * 50)
+
+    run_load_benchmark(loader, make_benchmark_dataframe)
+
+
+if __name__ == '__main__':
+    main()
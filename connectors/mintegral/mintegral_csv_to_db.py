@@ -1,9 +1,17 @@
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, bindparam
 import logging
 import os
+import csv
+import json
 import glob
-from datetime import datetime
+import time
+import codecs
+import hashlib
+import uuid
+import tempfile
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -15,11 +23,118 @@ PASSWORD = 'your_password_here'
 DATABASE = 'your_database_name_here'
 TABLE = 'mintegral_api_data'
 
+# Натуральный ключ записи: по нему работает уникальный индекс и upsert
+KEY_COLUMNS = ['account_id', 'date', 'campaign_key']
+
+# Справочник кампаний: (account_id, offer_id) -> суррогатный campaign_key, основная таблица хранит только ключ
+CAMPAIGNS_TABLE = 'mintegral_campaigns'
+
+# Справочник аккаунтов: название аккаунта хранится один раз, а не в каждой строке основной таблицы
+ACCOUNTS_TABLE = 'mintegral_accounts'
+
+# Представление с названиями аккаунтов и кампаний для отчетов, читавших их из основной таблицы
+NAMED_VIEW = f'{TABLE}_named'
+
+# Удаление старых колонок названий из основной таблицы после перевода на справочники необратимо и включается явно,
+# когда отчеты переведены на представление NAMED_VIEW
+MIGRATE_DROP_LEGACY_COLUMNS = False
+
+# Порядок колонок основной таблицы
+FACT_COLUMNS = ['account_id', 'date', 'campaign_key', 'impression', 'clicks', 'spend_in_dollars']
+
+# Способ записи в таблицу: 'insert' - пакетный INSERT ... ON DUPLICATE KEY UPDATE,
+# 'infile' - LOAD DATA LOCAL INFILE из временного TSV (быстрее для больших загрузок,
+# требует local_infile=1 на сервере)
+LOAD_METHOD = 'insert'
+
+# Загрузка через промежуточную таблицу без индексов с последующим слиянием в одной транзакции
+USE_STAGING_TABLE = True
+# Базовое имя промежуточной таблицы: каждый запуск добавляет к нему pid и случайный суффикс,
+# чтобы параллельные загрузки (загрузчик CSV и прямой конвейер) не удаляли данные друг друга
+STAGING_TABLE = f'{TABLE}_staging'
+
+# Журнал загруженных файлов: файл с уже загруженным содержимым пропускается по хешу
+LOADED_FILES_TABLE = f'{TABLE}_loaded_files'
+
+# Параллельная запись: DataFrame делится на партиции по account_id (крупные - по диапазонам дат)
+# и пишется в WRITE_WORKERS соединений; 1 - запись в одно соединение
+WRITE_WORKERS = 4
+PARALLEL_WRITE_MIN_ROWS = 20000
+PARTITION_COLUMN = 'account_id'
+WRITE_RETRIES = 2
+WRITE_RETRY_DELAY = 5
+
+# Сводка по данным, которую каждая загрузка обновляет приращениями: get_data_summary читает ее,
+# а не сканирует основную таблицу
+SUMMARY_TABLE = f'{TABLE}_summary'
+# Множество пар account_id × campaign_key с данными в основной таблице: по нему считается число кампаний в сводке
+SUMMARY_CAMPAIGNS_TABLE = f'{SUMMARY_TABLE}_campaigns'
+
+# Полный пересчет сводки по основной таблице при запуске (для сверки)
+RECOMPUTE_SUMMARY = False
+
+# Недельные (ISO, с понедельника) и месячные агрегаты аккаунт × кампания × период: пересчитываются
+# при каждой загрузке только для затронутых периодов, в той же транзакции, что и запись в основную таблицу
+ROLLUP_TABLES = {
+    'week': f'{TABLE}_weekly',
+    'month': f'{TABLE}_monthly',
+}
+
+# Начало периода для даты записи
+ROLLUP_PERIOD_START_SQL = {
+    'week': 'date - INTERVAL WEEKDAY(date) DAY',
+    'month': 'date - INTERVAL (DAYOFMONTH(date) - 1) DAY',
+}
+
+# Полный пересчет агрегатов по основной таблице при запуске (для сверки)
+RECOMPUTE_ROLLUPS = False
+
+# Обслуживание таблицы после загрузки: OPTIMIZE (полная перестройка, блокирует запись) выполняется только
+# при фрагментации не ниже порога, не чаще интервала и в разрешенные часы; в остальных случаях - ANALYZE,
+# тоже только при заметном изменении числа строк и не чаще своего интервала.
+# data_free относится к самой таблице только при innodb_file_per_table=ON; в общем табличном пространстве
+# это свободное место всего ibdata, и OPTIMIZE по нему не выполняется
+OPTIMIZE_FRAGMENTATION_THRESHOLD = 0.2  # Доля свободного места (data_free) от размера таблицы
+OPTIMIZE_MIN_FREE_MB = 100
+OPTIMIZE_MIN_INTERVAL_HOURS = 24 * 7
+OPTIMIZE_ALLOWED_HOURS = None  # Например range(1, 6) - только ночью; None - в любое время
+ANALYZE_CHANGED_ROWS_THRESHOLD = 0.1  # Доля изменения числа строк с последнего ANALYZE
+ANALYZE_MIN_INTERVAL_HOURS = 24
+MAINTENANCE_STATE_FILE = 'mintegral_maintenance_state.json'
+
+# Размер порции при чтении существующих ключей для фильтрации дубликатов
+DEDUP_QUERY_CHUNK_SIZE = 50000
+
+# Потоковая загрузка CSV порциями по CSV_CHUNK_SIZE строк (память ограничена размером порции);
+# 0 - читать файл целиком
+CSV_CHUNK_SIZE = 100000
+
+# Поддерживаемые кодировки CSV (в порядке проверки); windows-1251 - синоним cp1251
+CSV_ENCODINGS = ['utf-8', 'cp1251']
+
+# Явные кодировки файлов: JSON вида {"имя_файла.csv": "cp1251"}, для остальных файлов кодировка определяется
+ENCODING_MANIFEST_FILE = 'encoding_manifest.json'
+
+# Поддерживаемые форматы дат в CSV (в порядке проверки)
+DATE_FORMATS = [
+    '%Y-%m-%d',  # 2025-01-01 (основной формат из экспорта)
+    '%d.%m.%Y',  # 01.01.2025
+    '%d/%m/%Y',  # 01/01/2025
+    '%Y/%m/%d',  # 2025/01/01
+    '%d-%m-%Y',  # 01-01-2025
+]
+
 
 class DatabaseManager:
-    def __init__(self):
+    def __init__(self, load_method=None):
+        # Способ записи задается при создании: для 'infile' соединения открываются с local_infile
+        self.load_method = load_method or LOAD_METHOD
         self.connection_string = f'mysql+pymysql://{USER}:{PASSWORD}@{HOST}:{PORT}/{DATABASE}?charset=utf8mb4'
-        self.engine = create_engine(self.connection_string, pool_recycle=3600, pool_pre_ping=True, echo=False)
+        connect_args = {'local_infile': True} if self.load_method == 'infile' else {}
+        self.engine = create_engine(self.connection_string, pool_recycle=3600, pool_pre_ping=True, echo=False,
+                                    pool_size=max(WRITE_WORKERS, 5), connect_args=connect_args)
+        self.has_unique_key = False
+        self.staging_table = f'{STAGING_TABLE}_{os.getpid()}_{uuid.uuid4().hex[:8]}'
 
     def test_connection(self):
         """Проверка соединения с базой данных"""
@@ -61,16 +176,15 @@ class DatabaseManager:
         create_table_sql = f"""
         CREATE TABLE IF NOT EXISTS {TABLE} (
             account_id INT NOT NULL,
-            account_name TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci,
             date DATE NOT NULL,
-            campaign_name TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci,
+            campaign_key INT NOT NULL,
             impression INT DEFAULT 0,
             clicks INT DEFAULT 0,
             spend_in_dollars DECIMAL(15,4) DEFAULT 0.0000,
             INDEX idx_account_date (account_id, date),
             INDEX idx_date (date),
             INDEX idx_account_id (account_id),
-            INDEX idx_campaign_hash (account_id, date, campaign_name(255))
+            UNIQUE KEY uq_account_date_campaign_key (account_id, date, campaign_key)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
         """
 
@@ -83,6 +197,728 @@ class DatabaseManager:
             logger.error(f"❌ Ошибка создания таблицы: {e}")
             return False
 
+    def add_unique_key_if_not_exists(self):
+        """Добавить уникальный ключ по натуральному ключу записи (для обратной совместимости)"""
+        try:
+            check_index_sql = f"""
+            SELECT INDEX_NAME 
+            FROM INFORMATION_SCHEMA.STATISTICS 
+            WHERE TABLE_SCHEMA = '{DATABASE}' 
+            AND TABLE_NAME = '{TABLE}' 
+            AND INDEX_NAME = 'uq_account_date_campaign_key'
+            """
+
+            with self.engine.begin() as connection:
+                result = connection.execute(text(check_index_sql))
+                index_exists = result.fetchone()
+
+                if not index_exists:
+                    # ALTER IGNORE есть только в MariaDB: дубликаты удаляются отдельно, ключ добавляется обычным ALTER
+                    if not self.rebuild_without_duplicates(connection, 'uq_account_date_campaign_key'):
+                        add_index_sql = f"""
+                        ALTER TABLE {TABLE} 
+                        ADD UNIQUE KEY uq_account_date_campaign_key (account_id, date, campaign_key)
+                        """
+                        connection.execute(text(add_index_sql))
+                    logger.info("Уникальный ключ uq_account_date_campaign_key добавлен в таблицу")
+                else:
+                    logger.info("Уникальный ключ uq_account_date_campaign_key уже существует в таблице")
+
+            self.has_unique_key = True
+            return True
+
+        except Exception as e:
+            logger.error(f"Ошибка добавления уникального ключа: {e}")
+            logger.warning("Upsert отключен: новые строки добавляются без обновления существующих, "
+                           "дубликаты отфильтровываются на стороне Python")
+            return False
+
+    def rebuild_without_duplicates(self, connection, unique_key):
+        """Если в основной таблице есть дубликаты по натуральному ключу, пересобрать ее с уникальным ключом.
+
+        У таблицы нет суррогатного ключа, поэтому строки копируются через INSERT IGNORE в таблицу с уникальным
+        ключом (остается первая строка каждого ключа, как при ALTER IGNORE), которая затем подменяет основную.
+        Возвращает True, если таблица пересобрана и ключ уже добавлен
+        """
+        key_list = ', '.join(KEY_COLUMNS)
+        duplicates_sql = f"""
+        SELECT 1 FROM {TABLE} 
+        GROUP BY {key_list} 
+        HAVING COUNT(*) > 1 
+        LIMIT 1
+        """
+        if connection.execute(text(duplicates_sql)).fetchone() is None:
+            return False
+
+        dedup_table = f'{TABLE}_dedup'
+        old_table = f'{TABLE}_with_duplicates'
+        logger.warning(f"В {TABLE} есть дубликаты по ({key_list}), удаляем их перед добавлением уникального ключа")
+
+        connection.execute(text(f"DROP TABLE IF EXISTS {dedup_table}"))
+        connection.execute(text(f"CREATE TABLE {dedup_table} LIKE {TABLE}"))
+        connection.execute(text(f"ALTER TABLE {dedup_table} ADD UNIQUE KEY {unique_key} ({key_list})"))
+        connection.execute(text(f"INSERT IGNORE INTO {dedup_table} SELECT * FROM {TABLE}"))
+
+        # Переименование обеих таблиц одним RENAME TABLE атомарно
+        connection.execute(text(f"RENAME TABLE {TABLE} TO {old_table}, {dedup_table} TO {TABLE}"))
+        connection.execute(text(f"DROP TABLE {old_table}"))
+
+        logger.info(f"Дубликаты удалены из {TABLE}")
+        return True
+
+    def create_dimension_tables_if_not_exist(self):
+        """Создание справочников; таблица со старой схемой (названия в каждой строке) переводится на ключи"""
+        create_accounts_sql = f"""
+        CREATE TABLE IF NOT EXISTS {ACCOUNTS_TABLE} (
+            account_id INT NOT NULL PRIMARY KEY,
+            account_name TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """
+
+        create_campaigns_sql = f"""
+        CREATE TABLE IF NOT EXISTS {CAMPAIGNS_TABLE} (
+            campaign_key INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+            account_id INT NOT NULL,
+            offer_id BIGINT NULL,
+            campaign_name TEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            UNIQUE KEY uq_account_offer (account_id, offer_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """
+
+        create_view_sql = f"""
+        CREATE OR REPLACE VIEW {NAMED_VIEW} AS 
+        SELECT f.account_id, a.account_name, f.date, c.offer_id, c.campaign_name, 
+               f.impression, f.clicks, f.spend_in_dollars 
+        FROM {TABLE} f 
+        JOIN {CAMPAIGNS_TABLE} c ON c.campaign_key = f.campaign_key 
+        LEFT JOIN {ACCOUNTS_TABLE} a ON a.account_id = f.account_id
+        """
+
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(text(create_accounts_sql))
+                connection.execute(text(create_campaigns_sql))
+                self.migrate_campaign_names_to_keys(connection)
+                self.migrate_account_names(connection)
+                connection.execute(text(create_view_sql))
+
+            logger.info(f"✅ Справочники {ACCOUNTS_TABLE}, {CAMPAIGNS_TABLE} готовы")
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка создания справочников: {e}")
+            return False
+
+    def migrate_account_names(self, connection):
+        """Перенести названия аккаунтов из основной таблицы в справочник аккаунтов.
+
+        Колонка account_name удаляется только при MIGRATE_DROP_LEGACY_COLUMNS
+        """
+        columns_sql = f"""
+        SELECT COLUMN_NAME 
+        FROM INFORMATION_SCHEMA.COLUMNS 
+        WHERE TABLE_SCHEMA = '{DATABASE}' 
+        AND TABLE_NAME = '{TABLE}' 
+        AND COLUMN_NAME = 'account_name'
+        """
+        if connection.execute(text(columns_sql)).fetchone() is None:
+            return
+
+        # Пустой справочник заполняется по старым строкам один раз, дальше названия пишет загрузка.
+        # Перед удалением колонки переносятся и аккаунты, которых еще нет в справочнике
+        accounts_empty = connection.execute(text(f"SELECT 1 FROM {ACCOUNTS_TABLE} LIMIT 1")).fetchone() is None
+        if accounts_empty or MIGRATE_DROP_LEGACY_COLUMNS:
+            logger.info(f"Переносим названия аккаунтов из {TABLE} в {ACCOUNTS_TABLE}")
+
+            # IGNORE: названия, уже записанные загрузкой новых данных, не затираются старыми
+            connection.execute(text(f"""
+                INSERT IGNORE INTO {ACCOUNTS_TABLE} (account_id, account_name) 
+                SELECT account_id, MAX(account_name) FROM {TABLE} GROUP BY account_id
+            """))
+
+        if not MIGRATE_DROP_LEGACY_COLUMNS:
+            logger.info(f"В {TABLE} оставлена старая колонка account_name; удаление включается "
+                        f"MIGRATE_DROP_LEGACY_COLUMNS = True")
+            return
+
+        connection.execute(text(f"ALTER TABLE {TABLE} DROP COLUMN account_name"))
+
+        logger.info(f"✅ Колонка account_name удалена из {TABLE}")
+
+    def migrate_campaign_names_to_keys(self, connection):
+        """Перевести основную таблицу со старой схемой на ключи кампаний.
+
+        При первом запуске кампании заводятся по названиям старых строк, а строкам присваивается campaign_key.
+        Колонка campaign_name удаляется только при MIGRATE_DROP_LEGACY_COLUMNS и только если ключ есть у всех строк
+        """
+        columns_sql = f"""
+        SELECT COLUMN_NAME 
+        FROM INFORMATION_SCHEMA.COLUMNS 
+        WHERE TABLE_SCHEMA = '{DATABASE}' 
+        AND TABLE_NAME = '{TABLE}'
+        """
+        columns = {row[0] for row in connection.execute(text(columns_sql)).fetchall()}
+
+        if 'campaign_name' not in columns:
+            return
+
+        if 'campaign_key' not in columns:
+            logger.info(f"Переводим {TABLE} на ключи кампаний из {CAMPAIGNS_TABLE}")
+
+            connection.execute(text(f"ALTER TABLE {TABLE} ADD COLUMN campaign_key INT NULL AFTER date"))
+            self.assign_legacy_campaign_keys(connection)
+
+            # Производные таблицы со старыми ключами пересоздаются и строятся заново
+            for derived_table in [SUMMARY_CAMPAIGNS_TABLE, *ROLLUP_TABLES.values()]:
+                connection.execute(text(f"DROP TABLE IF EXISTS {derived_table}"))
+
+            logger.info(f"✅ {TABLE} переведена на ключи кампаний")
+
+        elif MIGRATE_DROP_LEGACY_COLUMNS:
+            # Строки, записанные в старую схему после первого перевода, получают ключи перед удалением колонки
+            self.assign_legacy_campaign_keys(connection)
+
+        if not MIGRATE_DROP_LEGACY_COLUMNS:
+            logger.info(f"В {TABLE} оставлена старая колонка campaign_name; удаление включается "
+                        f"MIGRATE_DROP_LEGACY_COLUMNS = True")
+            return
+
+        missing_keys = connection.execute(text(f"SELECT COUNT(*) FROM {TABLE} WHERE campaign_key IS NULL")).scalar()
+        if missing_keys:
+            logger.error(f"❌ Строк без campaign_key в {TABLE}: {missing_keys}, колонка campaign_name не удаляется")
+            return
+
+        indexes_sql = f"""
+        SELECT DISTINCT INDEX_NAME 
+        FROM INFORMATION_SCHEMA.STATISTICS 
+        WHERE TABLE_SCHEMA = '{DATABASE}' 
+        AND TABLE_NAME = '{TABLE}' 
+        AND INDEX_NAME IN ('uq_account_date_campaign', 'idx_campaign_hash')
+        """
+        alterations = [f"DROP INDEX {row[0]}" for row in connection.execute(text(indexes_sql)).fetchall()]
+        alterations += ["MODIFY campaign_key INT NOT NULL", "DROP COLUMN campaign_name"]
+        connection.execute(text(f"ALTER TABLE {TABLE} {', '.join(alterations)}"))
+
+        logger.info(f"✅ Колонка campaign_name удалена из {TABLE}")
+
+    def assign_legacy_campaign_keys(self, connection):
+        """Завести кампании по названиям строк старой схемы без campaign_key и присвоить этим строкам ключи"""
+        # Старые строки не содержат offer_id: кампании заводятся по названию внутри аккаунта,
+        # offer_id будет присвоен им при первой загрузке новых данных с тем же названием.
+        # Названия сравниваются побайтно (utf8mb4_bin): под utf8mb4_unicode_ci кампании, отличающиеся
+        # только регистром, слились бы в одну и их строки затерли бы друг друга по уникальному ключу
+        connection.execute(text(f"""
+            INSERT INTO {CAMPAIGNS_TABLE} (account_id, offer_id, campaign_name) 
+            SELECT f.account_id, NULL, MIN(COALESCE(f.campaign_name, '')) 
+            FROM {TABLE} f 
+            WHERE f.campaign_key IS NULL 
+            AND NOT EXISTS ( 
+                SELECT 1 FROM {CAMPAIGNS_TABLE} c 
+                WHERE c.account_id = f.account_id 
+                AND c.offer_id IS NULL 
+                AND c.campaign_name = COALESCE(f.campaign_name, '') COLLATE utf8mb4_bin 
+            ) 
+            GROUP BY f.account_id, COALESCE(f.campaign_name, '') COLLATE utf8mb4_bin
+        """))
+
+        connection.execute(text(f"""
+            UPDATE {TABLE} f 
+            JOIN {CAMPAIGNS_TABLE} c 
+                ON c.account_id = f.account_id 
+                AND c.offer_id IS NULL 
+                AND c.campaign_name = COALESCE(f.campaign_name, '') COLLATE utf8mb4_bin 
+            SET f.campaign_key = c.campaign_key 
+            WHERE f.campaign_key IS NULL
+        """))
+
+    def resolve_campaign_keys(self, df):
+        """Заменить offer_id и campaign_name ключом кампании из справочника, новые кампании добавляются в справочник,
+        названия аккаунтов обновляются в справочнике аккаунтов"""
+        if df.empty or 'campaign_key' in df.columns:
+            return df
+
+        offer_ids = df['offer_id'] if 'offer_id' in df.columns else pd.Series(pd.NA, index=df.index)
+        # Python int вместо numpy.int64: значения уходят параметрами в запросы
+        campaigns = list(dict.fromkeys(zip(
+            (int(account_id) for account_id in df['account_id']),
+            (None if pd.isna(offer_id) else int(offer_id) for offer_id in offer_ids),
+            df['campaign_name']
+        )))
+
+        upsert_account_sql = text(f"""
+            INSERT INTO {ACCOUNTS_TABLE} (account_id, account_name) 
+            VALUES (:account_id, :account_name) 
+            ON DUPLICATE KEY UPDATE account_name = VALUES(account_name)
+        """)
+        campaigns_query = text(f"""
+            SELECT campaign_key, account_id, offer_id, campaign_name 
+            FROM {CAMPAIGNS_TABLE} 
+            WHERE account_id IN :ids
+        """).bindparams(bindparam('ids', expanding=True))
+
+        insert_sql = text(f"""
+            INSERT INTO {CAMPAIGNS_TABLE} (account_id, offer_id, campaign_name) 
+            VALUES (:account_id, :offer_id, :campaign_name)
+        """)
+        update_sql = text(f"""
+            UPDATE {CAMPAIGNS_TABLE} 
+            SET offer_id = :offer_id, campaign_name = :campaign_name 
+            WHERE campaign_key = :campaign_key
+        """)
+
+        new_campaigns = 0
+        adopted_campaigns = 0
+
+        with self.engine.begin() as connection:
+            # Аккаунты: название обновляется одной строкой на аккаунт
+            accounts = df.drop_duplicates(subset=['account_id'], keep='last')
+            connection.execute(upsert_account_sql, [
+                {'account_id': int(account_id), 'account_name': account_name}
+                for account_id, account_name in zip(accounts['account_id'], accounts['account_name'])
+            ])
+
+            rows = connection.execute(campaigns_query, {'ids': sorted({campaign[0] for campaign in campaigns})})
+
+            offer_keys = {}
+            name_keys = {}
+            legacy_keys = {}
+            names = {}
+            for row in rows:
+                if row.offer_id is not None:
+                    offer_keys[(row.account_id, int(row.offer_id))] = row.campaign_key
+                else:
+                    legacy_keys[(row.account_id, row.campaign_name)] = row.campaign_key
+                name_keys.setdefault((row.account_id, row.campaign_name), row.campaign_key)
+                names[row.campaign_key] = row.campaign_name
+
+            for account_id, offer_id, campaign_name in campaigns:
+                if offer_id is None:
+                    # Строки без offer_id (старые файлы) сопоставляются по названию
+                    if (account_id, campaign_name) in name_keys:
+                        continue
+                    result = connection.execute(insert_sql, {'account_id': account_id, 'offer_id': None,
+                                                             'campaign_name': campaign_name})
+                    campaign_key = result.lastrowid
+                    legacy_keys[(account_id, campaign_name)] = campaign_key
+                    new_campaigns += 1
+
+                elif (account_id, offer_id) in offer_keys:
+                    campaign_key = offer_keys[(account_id, offer_id)]
+                    if names[campaign_key] != campaign_name:
+                        connection.execute(update_sql, {'offer_id': offer_id, 'campaign_name': campaign_name,
+                                                        'campaign_key': campaign_key})
+
+                elif (account_id, campaign_name) in legacy_keys:
+                    # Кампания из старых данных без offer_id получает offer_id и сохраняет свой ключ
+                    campaign_key = legacy_keys.pop((account_id, campaign_name))
+                    connection.execute(update_sql, {'offer_id': offer_id, 'campaign_name': campaign_name,
+                                                    'campaign_key': campaign_key})
+                    adopted_campaigns += 1
+
+                else:
+                    result = connection.execute(insert_sql, {'account_id': account_id, 'offer_id': offer_id,
+                                                             'campaign_name': campaign_name})
+                    campaign_key = result.lastrowid
+                    new_campaigns += 1
+
+                if offer_id is not None:
+                    offer_keys[(account_id, offer_id)] = campaign_key
+                names[campaign_key] = campaign_name
+                name_keys.setdefault((account_id, campaign_name), campaign_key)
+
+        if new_campaigns or adopted_campaigns:
+            logger.info(f"Справочник кампаний: добавлено {new_campaigns}, присвоен offer_id {adopted_campaigns}")
+
+        df_keyed = df.copy()
+        df_keyed['campaign_key'] = [
+            name_keys[(account_id, campaign_name)] if offer_id is None else offer_keys[(account_id, offer_id)]
+            for account_id, offer_id, campaign_name in zip(
+                (int(account_id) for account_id in df_keyed['account_id']),
+                (None if pd.isna(offer_id) else int(offer_id) for offer_id in offer_ids),
+                df_keyed['campaign_name']
+            )
+        ]
+
+        return df_keyed[FACT_COLUMNS]
+
+    def create_loaded_files_table_if_not_exists(self):
+        """Создание журнала загруженных файлов если не существует"""
+        create_table_sql = f"""
+        CREATE TABLE IF NOT EXISTS {LOADED_FILES_TABLE} (
+            content_hash CHAR(64) NOT NULL PRIMARY KEY,
+            file_name VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci,
+            row_count INT DEFAULT 0,
+            loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """
+
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(text(create_table_sql))
+            logger.info(f"Таблица {LOADED_FILES_TABLE} готова")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка создания таблицы {LOADED_FILES_TABLE}: {e}")
+            return False
+
+    def get_loaded_file(self, content_hash):
+        """Найти в журнале загрузку файла с таким же содержимым (поиск по первичному ключу)"""
+        try:
+            with self.engine.connect() as connection:
+                result = connection.execute(
+                    text(f"SELECT file_name, row_count, loaded_at FROM {LOADED_FILES_TABLE} WHERE content_hash = :content_hash"),
+                    {'content_hash': content_hash}
+                )
+                return result.fetchone()
+        except Exception as e:
+            logger.warning(f"Не удалось проверить журнал загруженных файлов: {e}")
+            return None
+
+    def insert_loaded_file(self, connection, loaded_file):
+        """Записать файл в журнал загруженных файлов в транзакции connection
+        (loaded_file - словарь с ключами file_name, content_hash, row_count)"""
+        mark_sql = f"""
+        INSERT INTO {LOADED_FILES_TABLE} (content_hash, file_name, row_count, loaded_at) 
+        VALUES (:content_hash, :file_name, :row_count, CURRENT_TIMESTAMP) 
+        ON DUPLICATE KEY UPDATE file_name = VALUES(file_name), row_count = VALUES(row_count), loaded_at = CURRENT_TIMESTAMP
+        """
+
+        connection.execute(text(mark_sql), {
+            'content_hash': loaded_file['content_hash'],
+            'file_name': loaded_file['file_name'],
+            'row_count': loaded_file['row_count'],
+        })
+
+    def mark_file_loaded(self, file_name, content_hash, row_count):
+        """Записать файл в журнал загруженных файлов"""
+        try:
+            with self.engine.begin() as connection:
+                self.insert_loaded_file(connection, {
+                    'content_hash': content_hash,
+                    'file_name': file_name,
+                    'row_count': row_count,
+                })
+            return True
+        except Exception as e:
+            logger.warning(f"Не удалось записать файл {file_name} в журнал загруженных файлов: {e}")
+            return False
+
+    def create_summary_tables_if_not_exist(self):
+        """Создание таблиц сводки; пустая сводка строится по уже загруженным данным"""
+        create_summary_sql = f"""
+        CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE} (
+            account_id INT NOT NULL PRIMARY KEY,
+            total_records BIGINT DEFAULT 0,
+            min_date DATE,
+            max_date DATE,
+            total_impressions BIGINT DEFAULT 0,
+            total_clicks BIGINT DEFAULT 0,
+            total_spend DECIMAL(20,4) DEFAULT 0
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """
+
+        create_campaigns_sql = f"""
+        CREATE TABLE IF NOT EXISTS {SUMMARY_CAMPAIGNS_TABLE} (
+            account_id INT NOT NULL,
+            campaign_key INT NOT NULL,
+            PRIMARY KEY (account_id, campaign_key)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """
+
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(text(create_summary_sql))
+                connection.execute(text(create_campaigns_sql))
+
+                summary_empty = any(
+                    connection.execute(text(f"SELECT 1 FROM {summary_table} LIMIT 1")).fetchone() is None
+                    for summary_table in (SUMMARY_TABLE, SUMMARY_CAMPAIGNS_TABLE)
+                )
+                table_empty = connection.execute(text(f"SELECT 1 FROM {TABLE} LIMIT 1")).fetchone() is None
+
+            logger.info(f"Таблицы сводки {SUMMARY_TABLE}, {SUMMARY_CAMPAIGNS_TABLE} готовы")
+
+            if summary_empty and not table_empty:
+                logger.info("Сводка пуста или неполна, строим ее по данным основной таблицы")
+                return self.recompute_summary()
+
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка создания таблиц сводки: {e}")
+            return False
+
+    def recompute_summary(self):
+        """Полный пересчет сводки по основной таблице"""
+        try:
+            started = time.monotonic()
+            with self.engine.begin() as connection:
+                connection.execute(text(f"DELETE FROM {SUMMARY_TABLE}"))
+                connection.execute(text(f"DELETE FROM {SUMMARY_CAMPAIGNS_TABLE}"))
+                self.refresh_summary(connection)
+            logger.info(f"Сводка пересчитана за {time.monotonic() - started:.1f}с")
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка пересчета сводки: {e}")
+            return False
+
+    def refresh_summary(self, connection, account_ids=None):
+        """Пересчитать строки сводки по основной таблице: все или только для указанных account_id"""
+        where = ''
+        params = {}
+        if account_ids is not None:
+            where = 'WHERE account_id IN :account_ids'
+            params = {'account_ids': [int(value) for value in account_ids]}
+
+        refresh_sql = f"""
+            INSERT INTO {SUMMARY_TABLE} 
+                (account_id, total_records, min_date, max_date, total_impressions, total_clicks, total_spend) 
+            SELECT account_id, COUNT(*), MIN(date), MAX(date), SUM(impression), SUM(clicks), SUM(spend_in_dollars) 
+            FROM {TABLE} 
+            {where} 
+            GROUP BY account_id 
+            ON DUPLICATE KEY UPDATE 
+                total_records = VALUES(total_records), 
+                min_date = VALUES(min_date), 
+                max_date = VALUES(max_date), 
+                total_impressions = VALUES(total_impressions), 
+                total_clicks = VALUES(total_clicks), 
+                total_spend = VALUES(total_spend)
+        """
+
+        refresh_campaigns_sql = f"""
+            INSERT IGNORE INTO {SUMMARY_CAMPAIGNS_TABLE} (account_id, campaign_key) 
+            SELECT DISTINCT account_id, campaign_key 
+            FROM {TABLE} 
+            {where}
+        """
+
+        for sql in (refresh_sql, refresh_campaigns_sql):
+            sql = text(sql)
+            if account_ids is not None:
+                sql = sql.bindparams(bindparam('account_ids', expanding=True))
+
+            connection.execute(sql, params)
+
+    def apply_summary_delta(self, connection, summary_delta=None):
+        """Добавить в сводку приращения: от данных промежуточной таблицы (вызывается до слияния)
+        или готовые приращения summary_delta из get_summary_delta"""
+        if summary_delta is not None:
+            self.apply_precomputed_summary_delta(connection, summary_delta)
+            return
+
+        join_condition = ' AND '.join(f't.{column} = s.{column}' for column in KEY_COLUMNS)
+
+        # Обновленные записи дают разницу нового и старого значения, новые - значение целиком.
+        # Без уникального ключа слияние переносит только новые записи
+        new_only = '' if self.has_unique_key else f'WHERE t.{KEY_COLUMNS[0]} IS NULL'
+
+        delta_sql = f"""
+            INSERT INTO {SUMMARY_TABLE} 
+                (account_id, total_records, min_date, max_date, total_impressions, total_clicks, total_spend) 
+            SELECT 
+                s.account_id, 
+                SUM(t.{KEY_COLUMNS[0]} IS NULL), 
+                MIN(s.date), 
+                MAX(s.date), 
+                SUM(s.impression - COALESCE(t.impression, 0)), 
+                SUM(s.clicks - COALESCE(t.clicks, 0)), 
+                SUM(s.spend_in_dollars - COALESCE(t.spend_in_dollars, 0)) 
+            FROM {self.staging_table} s 
+            LEFT JOIN {TABLE} t ON {join_condition} 
+            {new_only} 
+            GROUP BY s.account_id 
+            ON DUPLICATE KEY UPDATE 
+                total_records = total_records + VALUES(total_records), 
+                min_date = LEAST(COALESCE(min_date, VALUES(min_date)), VALUES(min_date)), 
+                max_date = GREATEST(COALESCE(max_date, VALUES(max_date)), VALUES(max_date)), 
+                total_impressions = total_impressions + VALUES(total_impressions), 
+                total_clicks = total_clicks + VALUES(total_clicks), 
+                total_spend = total_spend + VALUES(total_spend)
+        """
+
+        connection.execute(text(delta_sql))
+
+        connection.execute(text(f"""
+            INSERT IGNORE INTO {SUMMARY_CAMPAIGNS_TABLE} (account_id, campaign_key) 
+            SELECT DISTINCT account_id, campaign_key FROM {self.staging_table}
+        """))
+
+    def get_summary_delta(self, df):
+        """Приращения сводки от записи DataFrame сразу в основную таблицу (считаются до записи)"""
+        metrics = ['impression', 'clicks', 'spend_in_dollars']
+
+        existing_query = text(f"""
+            SELECT {', '.join(KEY_COLUMNS)}, {', '.join(metrics)} 
+            FROM {TABLE} 
+            WHERE account_id IN :ids 
+            AND date BETWEEN :date_from AND :date_to
+        """).bindparams(bindparam('ids', expanding=True))
+
+        params = {
+            'ids': [int(value) for value in df['account_id'].unique()],
+            'date_from': df['date'].min(),
+            'date_to': df['date'].max()
+        }
+
+        with self.engine.connect() as connection:
+            existing = pd.DataFrame(connection.execute(existing_query, params).fetchall(),
+                                    columns=KEY_COLUMNS + metrics)
+
+        # Обновленные записи дают разницу нового и старого значения, новые - значение целиком
+        merged = df[KEY_COLUMNS + metrics].merge(existing, on=KEY_COLUMNS, how='left', suffixes=('', '_old'),
+                                                 indicator=True)
+        merged['is_new'] = merged['_merge'] == 'left_only'
+        for metric in metrics:
+            merged[metric] = merged[metric].astype(float) - merged[f'{metric}_old'].astype(float).fillna(0)
+
+        delta = merged.groupby('account_id').agg(
+            total_records=('is_new', 'sum'),
+            min_date=('date', 'min'),
+            max_date=('date', 'max'),
+            total_impressions=('impression', 'sum'),
+            total_clicks=('clicks', 'sum'),
+            total_spend=('spend_in_dollars', 'sum')
+        )
+
+        # Python-типы вместо numpy: значения уходят параметрами в запрос
+        return {
+            'rows': [
+                {
+                    'account_id': int(group_id),
+                    'total_records': int(row['total_records']),
+                    'min_date': row['min_date'],
+                    'max_date': row['max_date'],
+                    'total_impressions': int(round(row['total_impressions'])),
+                    'total_clicks': int(round(row['total_clicks'])),
+                    'total_spend': float(row['total_spend'])
+                }
+                for group_id, row in delta.iterrows()
+            ],
+            'campaigns': [
+                {'account_id': int(group_id), 'campaign_key': int(campaign_key)}
+                for group_id, campaign_key in df[['account_id', 'campaign_key']].drop_duplicates().itertuples(index=False)
+            ]
+        }
+
+    def apply_precomputed_summary_delta(self, connection, summary_delta):
+        """Добавить в сводку приращения, посчитанные get_summary_delta"""
+        if not summary_delta['rows']:
+            return
+
+        delta_sql = f"""
+            INSERT INTO {SUMMARY_TABLE} 
+                (account_id, total_records, min_date, max_date, total_impressions, total_clicks, total_spend) 
+            VALUES (:account_id, :total_records, :min_date, :max_date, :total_impressions, :total_clicks, :total_spend) 
+            ON DUPLICATE KEY UPDATE 
+                total_records = total_records + VALUES(total_records), 
+                min_date = LEAST(COALESCE(min_date, VALUES(min_date)), VALUES(min_date)), 
+                max_date = GREATEST(COALESCE(max_date, VALUES(max_date)), VALUES(max_date)), 
+                total_impressions = total_impressions + VALUES(total_impressions), 
+                total_clicks = total_clicks + VALUES(total_clicks), 
+                total_spend = total_spend + VALUES(total_spend)
+        """
+
+        connection.execute(text(delta_sql), summary_delta['rows'])
+        connection.execute(
+            text(f"INSERT IGNORE INTO {SUMMARY_CAMPAIGNS_TABLE} (account_id, campaign_key) VALUES (:account_id, :campaign_key)"),
+            summary_delta['campaigns']
+        )
+
+    def create_rollup_tables_if_not_exist(self):
+        """Создание таблиц недельных и месячных агрегатов; пустые агрегаты строятся по уже загруженным данным"""
+        try:
+            rollups_empty = False
+
+            with self.engine.begin() as connection:
+                for rollup_table in ROLLUP_TABLES.values():
+                    create_rollup_sql = f"""
+                    CREATE TABLE IF NOT EXISTS {rollup_table} (
+                        account_id INT NOT NULL,
+                        campaign_key INT NOT NULL,
+                        period_start DATE NOT NULL,
+                        impression BIGINT DEFAULT 0,
+                        clicks BIGINT DEFAULT 0,
+                        spend_in_dollars DECIMAL(18,4) DEFAULT 0.0000,
+                        days INT DEFAULT 0,
+                        PRIMARY KEY (account_id, campaign_key, period_start),
+                        INDEX idx_period_start (period_start)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+                    """
+                    connection.execute(text(create_rollup_sql))
+
+                    if connection.execute(text(f"SELECT 1 FROM {rollup_table} LIMIT 1")).fetchone() is None:
+                        rollups_empty = True
+
+                table_empty = connection.execute(text(f"SELECT 1 FROM {TABLE} LIMIT 1")).fetchone() is None
+
+            logger.info(f"Таблицы агрегатов {', '.join(ROLLUP_TABLES.values())} готовы")
+
+            if rollups_empty and not table_empty:
+                logger.info("Агрегаты пусты, строим их по данным основной таблицы")
+                return self.recompute_rollups()
+
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка создания таблиц агрегатов: {e}")
+            return False
+
+    def recompute_rollups(self):
+        """Полный пересчет недельных и месячных агрегатов по основной таблице"""
+        try:
+            started = time.monotonic()
+            with self.engine.begin() as connection:
+                for rollup_table in ROLLUP_TABLES.values():
+                    connection.execute(text(f"DELETE FROM {rollup_table}"))
+                self.refresh_rollups(connection)
+            logger.info(f"Агрегаты пересчитаны за {time.monotonic() - started:.1f}с")
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка пересчета агрегатов: {e}")
+            return False
+
+    def refresh_rollups(self, connection, df=None):
+        """Пересчитать агрегаты: все или только периоды, затронутые записями DataFrame"""
+        # Затронутые периоды: для каждого account_id - от начала периода первой даты до конца периода последней
+        if df is None:
+            ranges = [None]
+        else:
+            dates = df.groupby('account_id')['date'].agg(['min', 'max'])
+            ranges = [(int(group_id), row['min'], row['max']) for group_id, row in dates.iterrows()]
+
+        for period, rollup_table in ROLLUP_TABLES.items():
+            range_filter = ''
+            if df is not None:
+                range_filter = 'WHERE account_id = :group_id AND date BETWEEN :date_from AND :date_to'
+
+            period_start = ROLLUP_PERIOD_START_SQL[period]
+            refresh_sql = text(f"""
+                INSERT INTO {rollup_table} (account_id, campaign_key, period_start, impression, clicks, spend_in_dollars, days) 
+                SELECT account_id, campaign_key, {period_start} AS period_start, SUM(impression), SUM(clicks), SUM(spend_in_dollars), COUNT(*) 
+                FROM {TABLE} 
+                {range_filter} 
+                GROUP BY account_id, campaign_key, period_start 
+                ON DUPLICATE KEY UPDATE 
+                    impression = VALUES(impression), 
+                    clicks = VALUES(clicks), 
+                    spend_in_dollars = VALUES(spend_in_dollars), 
+                    days = VALUES(days)
+            """)
+
+            for date_range in ranges:
+                params = {}
+                if date_range is not None:
+                    group_id, date_from, date_to = date_range
+                    date_from, date_to = get_period_bounds(period, date_from, date_to)
+                    params = {'group_id': group_id, 'date_from': date_from, 'date_to': date_to}
+
+                connection.execute(refresh_sql, params)
+
     def get_existing_records_count(self):
         """Получить количество существующих записей"""
         try:
@@ -100,32 +936,38 @@ class DatabaseManager:
             return df
 
         try:
-            # Получаем существующие комбинации account_id + date + campaign_name из БД
-            existing_query = f"""
-                SELECT DISTINCT account_id, date, campaign_name 
-                FROM {TABLE}
-            """
-
-            with self.engine.begin() as connection:
-                existing_df = pd.read_sql(existing_query, connection)
-
-            if existing_df.empty:
-                logger.info("БД пуста, все записи будут новыми")
+            # Получаем существующие комбинации account_id + date + campaign_key только для
+            # account_id и диапазона дат из загружаемых данных (запрос идет по индексу idx_account_date)
+            existing_query = text(f"""
+                SELECT {', '.join(KEY_COLUMNS)} 
+                FROM {TABLE} 
+                WHERE account_id IN :ids 
+                AND date BETWEEN :date_from AND :date_to
+            """).bindparams(bindparam('ids', expanding=True))
+
+            params = {
+                'ids': [int(value) for value in df['account_id'].unique()],
+                'date_from': df['date'].min(),
+                'date_to': df['date'].max()
+            }
+
+            # Читаем ключи порциями, не загружая весь результат в память
+            existing_keys = set()
+            with self.engine.connect() as connection:
+                result = connection.execution_options(stream_results=True).execute(existing_query, params)
+                for rows in result.partitions(DEDUP_QUERY_CHUNK_SIZE):
+                    existing_keys.update(tuple(row) for row in rows)
+
+            if not existing_keys:
+                logger.info("В БД нет записей за период загрузки, все записи будут новыми")
                 return df
 
             # Подсчитываем дубликаты ДО фильтрации
             before_count = len(df)
 
-            # Объединяем с существующими данными для поиска дубликатов
-            merged = df.merge(
-                existing_df,
-                on=['account_id', 'date', 'campaign_name'],
-                how='left',
-                indicator=True
-            )
-
             # Оставляем только новые записи (которых нет в БД)
-            df_clean = merged[merged['_merge'] == 'left_only'].drop('_merge', axis=1)
+            is_new = [key not in existing_keys for key in zip(*(df[column] for column in KEY_COLUMNS))]
+            df_clean = df[is_new]
 
             after_count = len(df_clean)
             duplicates_found = before_count - after_count
@@ -143,51 +985,279 @@ class DatabaseManager:
             logger.warning("Загружаем данные без фильтрации дубликатов")
             return df
 
-    def save_dataframe(self, df):
+    def save_dataframe(self, df, loaded_file=None):
         """Сохранить DataFrame в базу данных"""
         if df.empty:
             logger.warning("DataFrame пуст, нечего сохранять")
             return False
 
+        return self.save_dataframes([df], loaded_file) is not None
+
+    def save_dataframes(self, dataframes, loaded_file=None):
+        """Сохранить порции данных в базу данных; вернуть число сохраненных записей или None при ошибке.
+
+        loaded_file - запись журнала загруженных файлов (file_name, content_hash), row_count подставляется по итогу.
+        С промежуточной таблицей все порции сливаются с основной таблицей одной транзакцией, последней в которой
+        пишется запись журнала: при сбое не остается ни части данных, ни записи журнала.
+        Без промежуточной таблицы каждая порция фиксируется отдельно, журнал - после последней порции: при сбое
+        файл остается загруженным частично и без записи журнала, повторный запуск загружает его заново
+        (upsert или фильтрация дубликатов делают повтор идемпотентным)
+        """
         try:
-            # Удаляем дубликаты перед вставкой
-            df_clean = self.remove_duplicates_before_insert(df)
-
-            if df_clean.empty:
-                logger.info("После удаления дубликатов не осталось новых записей для загрузки")
-                return True
-
-            # Сохраняем только новые данные
-            df_clean.to_sql(
-                name=TABLE,
-                con=self.engine,
-                if_exists='append',
-                index=False,
-                chunksize=5000,
-                method='multi'
-            )
+            started = time.monotonic()
 
-            logger.info(f"✅ Сохранено новых записей в БД: {len(df_clean)}")
-            return True
+            if USE_STAGING_TABLE:
+                row_count, rows_affected = self.save_via_staging_table(dataframes, loaded_file)
+            else:
+                row_count, rows_affected = self.save_directly(dataframes, loaded_file)
+
+            elapsed = time.monotonic() - started
+            logger.info(f"✅ Записано в БД: {row_count} записей, затронуто строк: {rows_affected}")
+            logger.info(f"⏱️ Запись ({self.load_method}): {elapsed:.1f}с, {row_count / max(elapsed, 0.001):,.0f} записей/с")
+            return row_count
 
         except Exception as e:
             logger.error(f"❌ Ошибка сохранения данных: {e}")
-            return False
+            return None
+
+    def save_directly(self, dataframes, loaded_file=None):
+        """Запись порций сразу в основную таблицу, каждая порция - отдельно; вернуть (число записей, затронуто строк)"""
+        row_count = 0
+        rows_affected = 0
+
+        for df in dataframes:
+            df = self.resolve_campaign_keys(df)
+            if df.empty:
+                continue
+
+            row_count += len(df)
+
+            # Без уникального ключа уже загруженные записи отсекаются на стороне Python,
+            # иначе дубликаты отсекает сам движок: новые записи вставляются, существующие обновляются
+            if not self.has_unique_key:
+                df = self.remove_duplicates_before_insert(df)
+
+                if df.empty:
+                    logger.info("После удаления дубликатов не осталось новых записей для загрузки")
+                    continue
+
+            # Приращения сводки считаются по состоянию таблицы до записи, агрегаты пересчитываются только
+            # для затронутых периодов
+            summary_delta = self.get_summary_delta(df)
+            rows_affected += self.write_dataframe(df, TABLE) or 0
+
+            with self.engine.begin() as connection:
+                self.apply_summary_delta(connection, summary_delta)
+                self.refresh_rollups(connection, df)
+
+        if loaded_file:
+            self.mark_file_loaded(loaded_file['file_name'], loaded_file['content_hash'], row_count)
+
+        return row_count, rows_affected
+
+    def write_dataframe(self, df, table):
+        """Записать DataFrame в таблицу: крупные загрузки - параллельно по партициям"""
+        if WRITE_WORKERS > 1 and len(df) >= PARALLEL_WRITE_MIN_ROWS:
+            return self.write_partitions_parallel(df, table)
+
+        return self.write_partition(df, table)
+
+    def write_partitions_parallel(self, df, table):
+        """Параллельная запись партиций DataFrame через пул соединений"""
+        partitions = split_into_partitions(df, WRITE_WORKERS * 2)
+        logger.info(f"Параллельная запись в {table}: {len(df)} записей, {len(partitions)} партиций, "
+                    f"{WRITE_WORKERS} соединений")
+
+        started = time.monotonic()
+        written_rows = 0
+        rows_affected = 0
+
+        with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+            futures = {executor.submit(self.write_partition_with_retry, partition, table): len(partition)
+                       for partition in partitions}
+
+            for completed, future in enumerate(as_completed(futures), 1):
+                try:
+                    rows_affected += future.result() or 0
+                except Exception:
+                    # Оставшиеся партиции не запускаем - загрузка все равно завершится ошибкой
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+
+                written_rows += futures[future]
+                elapsed = time.monotonic() - started
+                logger.info(f"Партиций записано: {completed}/{len(partitions)}, записей: {written_rows}/{len(df)}, "
+                            f"{written_rows / max(elapsed, 0.001):,.0f} записей/с")
+
+        return rows_affected
+
+    def write_partition_with_retry(self, df, table):
+        """Записать партицию с повторными попытками (каждая запись выполняется в одной транзакции)"""
+        for attempt in range(1, WRITE_RETRIES + 2):
+            try:
+                return self.write_partition(df, table)
+            except Exception as e:
+                if attempt > WRITE_RETRIES:
+                    raise
+
+                logger.warning(f"Ошибка записи партиции ({len(df)} записей), попытка {attempt}/{WRITE_RETRIES + 1}: {e}")
+                time.sleep(WRITE_RETRY_DELAY * attempt)
+
+    def write_partition(self, df, table, load_method=None):
+        """Записать DataFrame в таблицу выбранным способом (по умолчанию - способом менеджера)"""
+        if (load_method or self.load_method) == 'infile':
+            return self.bulk_load_dataframe(df, table)
+
+        # Upsert нужен только при записи в основную таблицу с уникальным ключом
+        use_upsert = table == TABLE and self.has_unique_key
+
+        return df.to_sql(
+            name=table,
+            con=self.engine,
+            if_exists='append',
+            index=False,
+            chunksize=5000,
+            method=insert_on_duplicate_key_update if use_upsert else 'multi'
+        )
+
+    def create_staging_table(self):
+        """Создать пустую промежуточную таблицу без индексов"""
+        create_staging_sql = f"""
+        CREATE TABLE {self.staging_table} (
+            account_id INT NOT NULL,
+            date DATE NOT NULL,
+            campaign_key INT NOT NULL,
+            impression INT DEFAULT 0,
+            clicks INT DEFAULT 0,
+            spend_in_dollars DECIMAL(15,4) DEFAULT 0.0000
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+        """
+
+        with self.engine.begin() as connection:
+            connection.execute(text(create_staging_sql))
+
+    def drop_staging_table(self):
+        """Удалить промежуточную таблицу"""
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(text(f"DROP TABLE IF EXISTS {self.staging_table}"))
+        except Exception as e:
+            logger.warning(f"Не удалось удалить промежуточную таблицу {self.staging_table}: {e}")
+
+    def merge_staging_table(self, connection, columns):
+        """Перенести данные из промежуточной таблицы в основную одним запросом"""
+        column_list = ', '.join(columns)
+
+        if self.has_unique_key:
+            updates = ', '.join(f'{column} = VALUES({column})' for column in columns if column not in KEY_COLUMNS)
+            merge_sql = f"""
+                INSERT INTO {TABLE} ({column_list}) 
+                SELECT {column_list} FROM {self.staging_table} 
+                ON DUPLICATE KEY UPDATE {updates}
+            """
+        else:
+            # Без уникального ключа переносим только записи, которых еще нет в таблице
+            join_condition = ' AND '.join(f't.{column} = s.{column}' for column in KEY_COLUMNS)
+            merge_sql = f"""
+                INSERT INTO {TABLE} ({column_list}) 
+                SELECT {', '.join(f's.{column}' for column in columns)} 
+                FROM {self.staging_table} s 
+                LEFT JOIN {TABLE} t ON {join_condition} 
+                WHERE t.{KEY_COLUMNS[0]} IS NULL
+            """
+
+        result = connection.execute(text(merge_sql))
+        return result.rowcount
+
+    def save_via_staging_table(self, dataframes, loaded_file=None):
+        """Загрузка через промежуточную таблицу: быстрая вставка порций без индексов и слияние в одной транзакции;
+        вернуть (число записей, затронуто строк)"""
+        try:
+            self.create_staging_table()
+
+            started = time.monotonic()
+            row_count = 0
+            columns = None
+            date_bounds = []
+
+            for df in dataframes:
+                df = self.resolve_campaign_keys(df)
+                if df.empty:
+                    continue
+
+                self.write_dataframe(df, self.staging_table)
+                row_count += len(df)
+                columns = list(df.columns)
+                date_bounds.append(get_date_bounds(df))
+
+            logger.info(f"Загружено в промежуточную таблицу: {row_count} записей за {time.monotonic() - started:.1f}с")
+
+            # Основная таблица меняется только здесь: при сбое до коммита в ней не остается частичных данных
+            started = time.monotonic()
+            rows_affected = 0
+            with self.engine.begin() as connection:
+                if row_count:
+                    # Приращения сводки считаются по состоянию таблицы до слияния
+                    self.apply_summary_delta(connection)
+                    rows_affected = self.merge_staging_table(connection, columns)
+                    self.refresh_rollups(connection, pd.concat(date_bounds, ignore_index=True))
+
+                # Файл отмечается загруженным в той же транзакции, что и его данные
+                if loaded_file:
+                    self.insert_loaded_file(connection, {**loaded_file, 'row_count': row_count})
+            logger.info(f"✅ Слияние с {TABLE} выполнено за {time.monotonic() - started:.1f}с")
+
+            return row_count, rows_affected
+
+        finally:
+            self.drop_staging_table()
+
+    def bulk_load_dataframe(self, df, table=TABLE):
+        """Загрузить DataFrame через LOAD DATA LOCAL INFILE из временного TSV файла"""
+        tmp_file = tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='', suffix='.tsv', delete=False)
+
+        try:
+            with tmp_file:
+                # Табуляции, переводы строк и обратные слэши в данных экранируются для ESCAPED BY '\\'
+                df.to_csv(tmp_file, sep='\t', header=False, index=False, quoting=csv.QUOTE_NONE,
+                          escapechar='\\', lineterminator='\n', date_format='%Y-%m-%d')
+
+            # REPLACE заменяет существующие записи по уникальному ключу основной таблицы
+            duplicates_mode = ''
+            if table == TABLE:
+                duplicates_mode = 'REPLACE' if self.has_unique_key else 'IGNORE'
+
+            load_sql = f"""
+                LOAD DATA LOCAL INFILE :path 
+                {duplicates_mode} INTO TABLE {table} 
+                CHARACTER SET utf8mb4 
+                FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' 
+                LINES TERMINATED BY '\\n' 
+                ({', '.join(df.columns)})
+            """
+
+            with self.engine.begin() as connection:
+                result = connection.execute(text(load_sql), {'path': tmp_file.name})
+                return result.rowcount
+
+        finally:
+            os.remove(tmp_file.name)
 
     def get_data_summary(self):
-        """Получить сводку по данным в БД"""
+        """Получить сводку по данным в БД из таблицы сводки"""
         try:
             query = f"""
                 SELECT 
-                    COUNT(*) as total_records,
-                    COUNT(DISTINCT campaign_name) as unique_campaigns,
-                    COUNT(DISTINCT account_id) as unique_accounts,
-                    MIN(date) as min_date,
-                    MAX(date) as max_date,
-                    SUM(impression) as total_impressions,
-                    SUM(clicks) as total_clicks,
-                    SUM(spend_in_dollars) as total_spend
-                FROM {TABLE}
+                    SUM(total_records) as total_records,
+                    (SELECT COUNT(*) FROM {SUMMARY_CAMPAIGNS_TABLE}) as unique_campaigns,
+                    COUNT(*) as unique_accounts,
+                    MIN(min_date) as min_date,
+                    MAX(max_date) as max_date,
+                    SUM(total_impressions) as total_impressions,
+                    SUM(total_clicks) as total_clicks,
+                    SUM(total_spend) as total_spend
+                FROM {SUMMARY_TABLE}
             """
 
             with self.engine.begin() as connection:
@@ -196,7 +1266,7 @@ class DatabaseManager:
 
                 if row:
                     return {
-                        'total_records': row[0],
+                        'total_records': int(row[0] or 0),
                         'unique_campaigns': row[1],
                         'unique_accounts': row[2],
                         'min_date': row[3].strftime('%Y-%m-%d') if row[3] else None,
@@ -211,29 +1281,187 @@ class DatabaseManager:
             logger.error(f"Ошибка получения сводки: {e}")
             return None
 
+    def get_table_stats(self):
+        """Размер и фрагментация таблицы по information_schema.TABLES"""
+        stats_sql = """
+            SELECT DATA_LENGTH, INDEX_LENGTH, DATA_FREE, TABLE_ROWS 
+            FROM information_schema.TABLES 
+            WHERE TABLE_SCHEMA = :schema AND TABLE_NAME = :table
+        """
+
+        with self.engine.connect() as connection:
+            row = connection.execute(text(stats_sql), {'schema': DATABASE, 'table': TABLE}).fetchone()
+            file_per_table = connection.execute(text("SELECT @@innodb_file_per_table")).scalar()
+
+        if not row:
+            return None
+
+        data_length, index_length, data_free, table_rows = (int(value or 0) for value in row)
+        total_size = data_length + index_length + data_free
+
+        return {
+            'data_length': data_length,
+            'index_length': index_length,
+            'data_free': data_free,
+            'table_rows': table_rows,
+            'fragmentation': data_free / total_size if total_size else 0.0,
+            'file_per_table': str(file_per_table).upper() in ('1', 'ON')
+        }
+
     def optimize_table(self):
         """Оптимизация таблицы"""
         try:
             with self.engine.begin() as connection:
                 connection.execute(text(f"OPTIMIZE TABLE {TABLE}"))
             logger.info("✅ Таблица оптимизирована")
+            return True
         except Exception as e:
             logger.error(f"❌ Ошибка оптимизации таблицы: {e}")
+            return False
+
+    def analyze_table(self):
+        """Обновление статистики индексов без перестройки таблицы"""
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(text(f"ANALYZE TABLE {TABLE}"))
+            logger.info("✅ Статистика таблицы обновлена")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления статистики таблицы: {e}")
+            return False
+
+    def run_maintenance(self):
+        """Обслуживание таблицы: OPTIMIZE при выполнении условий (см. should_optimize_table), иначе ANALYZE
+        при выполнении своих условий (см. should_analyze_table)"""
+        try:
+            stats = self.get_table_stats()
+        except Exception as e:
+            logger.warning(f"Не удалось получить статистику таблицы: {e}")
+            stats = None
+
+        if stats:
+            logger.info(f"🧹 Таблица {TABLE}: ~{stats['table_rows']:,} строк, "
+                        f"данные {stats['data_length'] / 1024 ** 2:,.1f} МБ, индексы {stats['index_length'] / 1024 ** 2:,.1f} МБ, "
+                        f"свободно {stats['data_free'] / 1024 ** 2:,.1f} МБ ({stats['fragmentation']:.1%})")
+
+        maintenance_state = load_maintenance_state()
+        now = datetime.now()
+
+        # OPTIMIZE в InnoDB пересоздает таблицу и заодно обновляет статистику
+        if stats and should_optimize_table(stats, maintenance_state.get('last_optimized_at'), now):
+            if self.optimize_table():
+                maintenance_state['last_optimized_at'] = now.isoformat(timespec='seconds')
+                maintenance_state['last_analyzed_at'] = maintenance_state['last_optimized_at']
+                maintenance_state['analyzed_rows'] = stats['table_rows']
+                save_maintenance_state(maintenance_state)
+            return
+
+        if should_analyze_table(stats, maintenance_state, now) and self.analyze_table():
+            maintenance_state['last_analyzed_at'] = now.isoformat(timespec='seconds')
+            if stats:
+                maintenance_state['analyzed_rows'] = stats['table_rows']
+            save_maintenance_state(maintenance_state)
+
+
+def should_optimize_table(stats, last_optimized_at, now):
+    """Нужна ли перестройка таблицы: порог фрагментации, минимальный объем свободного места, интервал и окно времени"""
+    if not stats['file_per_table']:
+        logger.info("Перестройка таблицы пропущена: без innodb_file_per_table data_free не отражает фрагментацию таблицы")
+        return False
+
+    if stats['fragmentation'] < OPTIMIZE_FRAGMENTATION_THRESHOLD:
+        return False
+
+    if stats['data_free'] < OPTIMIZE_MIN_FREE_MB * 1024 ** 2:
+        return False
+
+    if OPTIMIZE_ALLOWED_HOURS is not None and now.hour not in OPTIMIZE_ALLOWED_HOURS:
+        logger.info("Перестройка таблицы отложена: вне разрешенного времени")
+        return False
+
+    if last_optimized_at:
+        hours_since = (now - datetime.fromisoformat(last_optimized_at)).total_seconds() / 3600
+        if hours_since < OPTIMIZE_MIN_INTERVAL_HOURS:
+            logger.info(f"Перестройка таблицы отложена: прошло {hours_since:.0f}ч из {OPTIMIZE_MIN_INTERVAL_HOURS}ч")
+            return False
+
+    return True
+
+
+def should_analyze_table(stats, maintenance_state, now):
+    """Нужно ли обновить статистику индексов: интервал с последнего ANALYZE и доля изменения числа строк"""
+    last_analyzed_at = maintenance_state.get('last_analyzed_at')
+    if not last_analyzed_at:
+        return True
+
+    hours_since = (now - datetime.fromisoformat(last_analyzed_at)).total_seconds() / 3600
+    if hours_since < ANALYZE_MIN_INTERVAL_HOURS:
+        return False
+
+    # Без статистики таблицы порог по строкам не проверить: достаточно интервала
+    analyzed_rows = maintenance_state.get('analyzed_rows')
+    if not stats or not analyzed_rows:
+        return True
+
+    changed_share = abs(stats['table_rows'] - analyzed_rows) / analyzed_rows
+    if changed_share < ANALYZE_CHANGED_ROWS_THRESHOLD:
+        logger.info(f"Обновление статистики таблицы пропущено: число строк изменилось на {changed_share:.1%}")
+        return False
+
+    return True
+
+
+def load_maintenance_state():
+    """Загрузить время последнего обслуживания таблицы"""
+    if not os.path.exists(MAINTENANCE_STATE_FILE):
+        return {}
+
+    try:
+        with open(MAINTENANCE_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать состояние обслуживания {MAINTENANCE_STATE_FILE}: {e}")
+        return {}
+
+
+def save_maintenance_state(maintenance_state):
+    """Сохранить время последнего обслуживания таблицы"""
+    try:
+        tmp_path = f'{MAINTENANCE_STATE_FILE}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(maintenance_state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, MAINTENANCE_STATE_FILE)
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить состояние обслуживания {MAINTENANCE_STATE_FILE}: {e}")
+
+
+def insert_on_duplicate_key_update(table, conn, keys, data_iter):
+    """Метод вставки для DataFrame.to_sql: пакетный INSERT ... ON DUPLICATE KEY UPDATE по натуральному ключу"""
+    columns = ', '.join(keys)
+    placeholders = ', '.join(f':{key}' for key in keys)
+    updates = ', '.join(f'{key} = VALUES({key})' for key in keys if key not in KEY_COLUMNS)
+
+    upsert_sql = f"""
+        INSERT INTO {table.name} ({columns}) 
+        VALUES ({placeholders}) 
+        ON DUPLICATE KEY UPDATE {updates}
+    """
+
+    rows = [dict(zip(keys, row)) for row in data_iter]
+    result = conn.execute(text(upsert_sql), rows)
+    return result.rowcount
 
 
 def find_csv_files():
-    """Найти самый свежий CSV файл от нашего скрипта"""
+    """Найти все CSV файлы от нашего скрипта (в порядке выгрузки)"""
     # Ищем файлы нашего скрипта по шаблону mintegral_data_YYYYMMDD_HHMMSS.csv
     mintegral_files = glob.glob('mintegral_data_*.csv')
 
+    # Посторонние CSV не подбираются: их формат не гарантирован, а уже загруженные файлы
+    # и так пропускаются по журналу загрузок
     if not mintegral_files:
-        logger.warning("Не найдены файлы mintegral_data_*.csv, ищем любые CSV файлы")
-        # Если нет наших файлов, берем любые CSV
-        csv_files = glob.glob('*.csv')
-        if csv_files:
-            return [max(csv_files, key=os.path.getctime)]  # Самый новый по времени создания
-        else:
-            return []
+        logger.warning("Не найдены файлы mintegral_data_*.csv")
+        return []
 
     # Сортируем наши файлы по timestamp в имени (самый новый последним)
     def extract_timestamp(filename):
@@ -248,15 +1476,12 @@ def find_csv_files():
             # Если не удалось распарсить, возвращаем очень старую дату
             return datetime(1900, 1, 1)
 
-    # Сортируем файлы по timestamp и берем самый новый
-    sorted_files = sorted(mintegral_files, key=extract_timestamp, reverse=True)
-    latest_file = sorted_files[0]
+    # Сортируем файлы по timestamp: более свежие выгрузки загружаются позже и перезаписывают старые данные
+    sorted_files = sorted(mintegral_files, key=extract_timestamp)
 
-    logger.info(f"Найдено файлов mintegral_data: {len(mintegral_files)}")
-    logger.info(f"Выбран самый свежий файл: {latest_file}")
+    logger.info(f"Найдено файлов mintegral_data: {len(sorted_files)}")
 
-    # Возвращаем только самый свежий файл
-    return [latest_file]
+    return sorted_files
 
 
 def load_csv_file(filename):
@@ -264,27 +1489,72 @@ def load_csv_file(filename):
     try:
         logger.info(f"Загружаем файл: {filename}")
 
-        # Пробуем разные кодировки
-        encodings = ['utf-8', 'cp1251', 'windows-1251']
+        # Кодировка определяется заранее, файл разбирается один раз
+        encoding = get_file_encoding(filename)
+        if encoding is None:
+            logger.error(f"Не удалось загрузить файл {filename} ни с одной кодировкой")
+            return pd.DataFrame()
 
-        for encoding in encodings:
-            try:
-                df = pd.read_csv(filename, encoding=encoding)
-                logger.info(f"Файл {filename} загружен с кодировкой {encoding}")
-                logger.info(f"Количество записей: {len(df)}")
-                return df
-            except UnicodeDecodeError:
-                continue
-
-        # Если все кодировки не подошли
-        logger.error(f"Не удалось загрузить файл {filename} ни с одной кодировкой")
-        return pd.DataFrame()
+        df = pd.read_csv(filename, encoding=encoding)
+        logger.info(f"Файл {filename} загружен с кодировкой {encoding}")
+        logger.info(f"Количество записей: {len(df)}")
+        return df
 
     except Exception as e:
         logger.error(f"Ошибка загрузки файла {filename}: {e}")
         return pd.DataFrame()
 
 
+def load_encoding_manifest():
+    """Загрузить явно заданные кодировки файлов"""
+    if not os.path.exists(ENCODING_MANIFEST_FILE):
+        return {}
+
+    try:
+        with open(ENCODING_MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать манифест кодировок {ENCODING_MANIFEST_FILE}: {e}")
+        return {}
+
+
+def get_file_encoding(filename):
+    """Кодировка файла: из манифеста, если задана явно, иначе определяется по содержимому"""
+    encoding = load_encoding_manifest().get(os.path.basename(filename))
+    if encoding:
+        return encoding
+
+    return detect_file_encoding(filename)
+
+
+def detect_file_encoding(filename, encodings=CSV_ENCODINGS, block_size=1024 * 1024):
+    """Определить кодировку файла за один проход по байтам с инкрементальным декодированием"""
+    for encoding in encodings:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(block_size), b''):
+                    decoder.decode(block)
+                decoder.decode(b'', final=True)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+
+    return None
+
+
+def drop_keys_seen_in_file(df, seen_keys):
+    """Убрать записи, ключи которых уже встречались в файле (в том числе в предыдущих порциях)"""
+    df = df.drop_duplicates(subset=KEY_COLUMNS)
+
+    # Вместо самих ключей храним их 64-битные хеши - так набор остается компактным для больших файлов
+    key_hashes = pd.util.hash_pandas_object(df[KEY_COLUMNS], index=False).tolist()
+    is_new = [key_hash not in seen_keys for key_hash in key_hashes]
+    seen_keys.update(key_hashes)
+
+    return df[is_new]
+
+
 def validate_csv_structure(df):
     """Проверить структуру CSV файла"""
     required_columns = [
@@ -303,30 +1573,92 @@ def validate_csv_structure(df):
     return True
 
 
-def parse_date_column(date_str):
-    """Парсинг даты из различных форматов"""
-    if pd.isna(date_str) or date_str == '':
-        return None
+def split_into_partitions(df, partitions):
+    """Разбить DataFrame на партиции по account_id: мелкие группы объединяются, крупные делятся по диапазонам дат"""
+    target_size = max(1, -(-len(df) // partitions))
+    result = []
+    current = []
+    current_size = 0
+
+    for _, group in df.groupby(PARTITION_COLUMN, sort=True):
+        group = group.sort_values('date')
+
+        for start in range(0, len(group), target_size):
+            piece = group.iloc[start:start + target_size]
+            current.append(piece)
+            current_size += len(piece)
+
+            if current_size >= target_size:
+                result.append(pd.concat(current))
+                current = []
+                current_size = 0
+
+    if current:
+        result.append(pd.concat(current))
+
+    return result
+
+
+def get_date_bounds(df):
+    """Первая и последняя дата записей каждого account_id: по ним пересчитываются затронутые периоды агрегатов"""
+    bounds = df.groupby('account_id')['date'].agg(['min', 'max']).reset_index()
+    return bounds.melt(id_vars='account_id', value_name='date')[['account_id', 'date']]
 
-    # Список возможных форматов
-    date_formats = [
-        '%Y-%m-%d',  # 2025-01-01 (основной формат из экспорта)
-        '%d.%m.%Y',  # 01.01.2025
-        '%d/%m/%Y',  # 01/01/2025
-        '%Y/%m/%d',  # 2025/01/01
-        '%d-%m-%Y',  # 01-01-2025
-    ]
 
-    for fmt in date_formats:
+def get_period_bounds(period, date_from, date_to):
+    """Расширить диапазон дат до границ периодов агрегатов (ISO неделя с понедельника или календарный месяц)"""
+    if period == 'week':
+        return date_from - timedelta(days=date_from.weekday()), date_to + timedelta(days=6 - date_to.weekday())
+
+    next_month = date_to.replace(day=28) + timedelta(days=4)
+    return date_from.replace(day=1), next_month - timedelta(days=next_month.day)
+
+
+def parse_date_value(value):
+    """Парсинг одного значения даты из различных форматов (None - если ни один формат не подошел)"""
+    for fmt in DATE_FORMATS:
         try:
-            return datetime.strptime(str(date_str), fmt).date()
+            return datetime.strptime(value, fmt).date()
         except ValueError:
             continue
 
-    logger.warning(f"Не удалось распарсить дату: {date_str}")
     return None
 
 
+def parse_date_series(dates):
+    """Векторный парсинг дат из различных форматов"""
+    # Каждый формат применяется ко всей колонке, следующий - только к еще не распознанным значениям
+    values = dates.astype(str)
+    remaining = dates.notna() & (values != '')
+    parsed = pd.Series(None, index=dates.index, dtype=object)
+
+    for fmt in DATE_FORMATS:
+        if not remaining.any():
+            break
+
+        converted = pd.to_datetime(values[remaining], format=fmt, errors='coerce')
+        converted = converted[converted.notna()]
+        # Результат хранится как datetime.date: даты вне диапазона datetime64[ns] (например 9999-12-31) допустимы
+        parsed[converted.index] = converted.dt.date
+        remaining[converted.index] = False
+
+    # Значения, которые векторный парсинг не распознал (в т.ч. даты вне диапазона datetime64 в старых pandas),
+    # проверяются построчно через strptime
+    if remaining.any():
+        fallback = values[remaining].map(parse_date_value)
+        fallback = fallback[fallback.notna()]
+        parsed[fallback.index] = fallback
+        remaining[fallback.index] = False
+
+    invalid_values = values[remaining].unique()
+    for value in invalid_values[:10]:
+        logger.warning(f"Не удалось распарсить дату: {value}")
+    if len(invalid_values) > 10:
+        logger.warning(f"... и еще {len(invalid_values) - 10} нераспознанных значений дат")
+
+    return parsed
+
+
 def prepare_dataframe_for_db(df):
     """Подготовить DataFrame для загрузки в БД"""
     if df.empty:
@@ -338,7 +1670,7 @@ def prepare_dataframe_for_db(df):
     df_clean = df.copy()
 
     # Обрабатываем даты
-    df_clean['date'] = df_clean['date'].apply(parse_date_column)
+    df_clean['date'] = parse_date_series(df_clean['date'])
 
     # Удаляем записи с невалидными датами
     before_count = len(df_clean)
@@ -354,6 +1686,12 @@ def prepare_dataframe_for_db(df):
     df_clean['clicks'] = pd.to_numeric(df_clean['clicks'], errors='coerce').fillna(0).astype(int)
     df_clean['spend_in_dollars'] = pd.to_numeric(df_clean['spend_in_dollars'], errors='coerce').fillna(0).round(4)
 
+    # Offer ID есть только в новых выгрузках: в старых файлах кампании сопоставляются по названию
+    if 'offer_id' in df_clean.columns:
+        df_clean['offer_id'] = pd.to_numeric(df_clean['offer_id'], errors='coerce').astype('Int64')
+    else:
+        df_clean['offer_id'] = pd.Series(pd.NA, index=df_clean.index, dtype='Int64')
+
     # Приводим текстовые поля к строкам
     df_clean['account_name'] = df_clean['account_name'].astype(str)
     df_clean['campaign_name'] = df_clean['campaign_name'].astype(str)
@@ -365,34 +1703,237 @@ def prepare_dataframe_for_db(df):
     return df_clean
 
 
-def main():
-    print("MINTEGRAL CSV TO DATABASE LOADER")
-    print("=" * 50)
+def load_csv_file_at_once(db_manager, csv_file, loaded_file=None):
+    """Загрузить CSV файл в БД целиком; вернуть число загруженных записей или None при ошибке"""
+    # Загружаем CSV
+    df = load_csv_file(csv_file)
 
+    if df.empty:
+        logger.error(f"Файл {csv_file} пуст или не удалось загрузить")
+        return None
+
+    return load_dataframe(db_manager, df, f"Файл {csv_file}", loaded_file)
+
+
+def load_dataframe(db_manager, df, source, loaded_file=None):
+    """Загрузить DataFrame в формате выгрузки в БД; вернуть число загруженных записей или None при ошибке.
+
+    loaded_file - запись журнала загруженных файлов (file_name, content_hash), которая фиксируется вместе с данными
+    """
+    # Проверяем структуру
+    if not validate_csv_structure(df):
+        logger.error(f"{source}: неправильная структура данных")
+        return None
+
+    # Подготавливаем данные и заменяем кампании ключами из справочника
+    df_prepared = db_manager.resolve_campaign_keys(prepare_dataframe_for_db(df))
+
+    if df_prepared.empty:
+        logger.warning(f"{source}: после обработки данных не осталось")
+        if loaded_file:
+            db_manager.mark_file_loaded(loaded_file['file_name'], loaded_file['content_hash'], 0)
+        return 0
+
+    logger.info(f"{source}: подготовлено {len(df_prepared)} записей")
+
+    # Удаляем внутренние дубликаты
+    before_dedup = len(df_prepared)
+    df_prepared = df_prepared.drop_duplicates(subset=KEY_COLUMNS)
+    after_dedup = len(df_prepared)
+
+    if before_dedup != after_dedup:
+        logger.info(f"Удалено внутренних дубликатов: {before_dedup - after_dedup}")
+
+    logger.info(f"Итого записей для загрузки: {len(df_prepared)}")
+
+    # Сохраняем в БД
+    if not db_manager.save_dataframe(df_prepared, loaded_file):
+        return None
+
+    return len(df_prepared)
+
+
+def iter_prepared_chunks(db_manager, csv_file, chunks, stats):
+    """Подготовленные порции CSV файла без записей, ключи которых уже встречались в файле; счетчики строк - в stats"""
+    seen_keys = set()
+
+    for chunk_number, chunk in enumerate(chunks, 1):
+        # Структура одинакова для всех порций, проверяем по первой
+        if chunk_number == 1 and not validate_csv_structure(chunk):
+            raise ValueError(f"Файл {csv_file} имеет неправильную структуру")
+
+        stats['total_rows'] += len(chunk)
+
+        df_prepared = db_manager.resolve_campaign_keys(prepare_dataframe_for_db(chunk))
+        if df_prepared.empty:
+            continue
+
+        # Удаляем внутренние дубликаты в файле, в том числе между порциями
+        df_new = drop_keys_seen_in_file(df_prepared, seen_keys)
+        stats['duplicate_rows'] += len(df_prepared) - len(df_new)
+        if df_new.empty:
+            continue
+
+        logger.info(f"Порция {chunk_number}: прочитано {stats['total_rows']} строк, подготовлено {len(df_new)} записей")
+        yield df_new
+
+    if stats['total_rows'] == 0:
+        raise ValueError(f"Файл {csv_file} пуст")
+
+
+def load_csv_file_in_chunks(db_manager, csv_file, loaded_file=None):
+    """Потоковая загрузка CSV файла в БД порциями по CSV_CHUNK_SIZE строк; вернуть число загруженных записей или None при ошибке.
+
+    Порции сохраняются через DatabaseManager.save_dataframes: с промежуточной таблицей файл и запись журнала
+    loaded_file фиксируются одной транзакцией
+    """
+    encoding = get_file_encoding(csv_file)
+    if encoding is None:
+        logger.error(f"Не удалось загрузить файл {csv_file} ни с одной кодировкой")
+        return None
+
+    logger.info(f"Загружаем файл: {csv_file} (кодировка {encoding}, порции по {CSV_CHUNK_SIZE} строк)")
+
+    stats = {'total_rows': 0, 'duplicate_rows': 0}
+
+    try:
+        chunks = pd.read_csv(csv_file, encoding=encoding, chunksize=CSV_CHUNK_SIZE)
+    except Exception as e:
+        logger.error(f"Ошибка потоковой загрузки файла {csv_file}: {e}")
+        return None
+
+    loaded_rows = db_manager.save_dataframes(iter_prepared_chunks(db_manager, csv_file, chunks, stats), loaded_file)
+    if loaded_rows is None:
+        logger.error(f"❌ Ошибка загрузки файла {csv_file}")
+        return None
+
+    if stats['duplicate_rows']:
+        logger.info(f"Удалено внутренних дубликатов в файле: {stats['duplicate_rows']}")
+
+    logger.info(f"Итого записей загружено: {loaded_rows} из {stats['total_rows']} строк файла")
+    return loaded_rows
+
+
+def compute_file_hash(filename, block_size=1024 * 1024):
+    """SHA-256 содержимого файла"""
+    file_hash = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def load_pending_csv_file(db_manager, csv_file):
+    """Загрузить CSV файл, если он еще не загружался; вернуть 'loaded', 'skipped' или 'failed'"""
+    try:
+        content_hash = compute_file_hash(csv_file)
+    except Exception as e:
+        logger.error(f"Не удалось прочитать файл {csv_file}: {e}")
+        return 'failed'
+
+    loaded_file = db_manager.get_loaded_file(content_hash)
+    if loaded_file:
+        logger.info(f"Файл {csv_file} уже загружен ({loaded_file.file_name}, {loaded_file.loaded_at}), пропускаем")
+        return 'skipped'
+
+    logger.info(f"Обрабатываем файл: {csv_file}")
+
+    # Запись журнала фиксируется вместе с данными файла
+    loaded_file = {'file_name': os.path.basename(csv_file), 'content_hash': content_hash}
+
+    if CSV_CHUNK_SIZE:
+        row_count = load_csv_file_in_chunks(db_manager, csv_file, loaded_file)
+    else:
+        row_count = load_csv_file_at_once(db_manager, csv_file, loaded_file)
+
+    if row_count is None:
+        return 'failed'
+
+    return 'loaded'
+
+
+def prepare_database(load_method=None):
+    """Подключиться к БД и подготовить таблицы; вернуть DatabaseManager или None при ошибке"""
     # Проверка параметров подключения к БД
     if not all([HOST, USER, PASSWORD, DATABASE]):
         logger.error("❌ Не указаны параметры подключения к БД!")
-        return
+        return None
 
     # Инициализация менеджера БД
-    db_manager = DatabaseManager()
+    db_manager = DatabaseManager(load_method)
 
     # Создание базы данных если не существует
     if not db_manager.create_database_if_not_exists():
         logger.error("Не удалось создать базу данных")
-        return
+        return None
 
     # Проверка соединения
     if not db_manager.test_connection():
         logger.error("Не удалось подключиться к базе данных")
-        return
+        return None
 
     # Создание таблицы
     if not db_manager.create_table_if_not_exists():
         logger.error("Не удалось создать таблицу")
+        return None
+
+    # Справочники аккаунтов и кампаний (таблица со старой схемой переводится на ключи)
+    if not db_manager.create_dimension_tables_if_not_exist():
+        logger.error("Не удалось создать справочники")
+        return None
+
+    # Уникальный ключ для загрузки через upsert (для обратной совместимости)
+    db_manager.add_unique_key_if_not_exists()
+
+    # Сводка по данным (строится при первом запуске, далее обновляется при каждой загрузке)
+    if not db_manager.create_summary_tables_if_not_exist():
+        logger.warning("Не удалось создать таблицы сводки")
+    elif RECOMPUTE_SUMMARY:
+        db_manager.recompute_summary()
+
+    # Недельные и месячные агрегаты для отчетов
+    if not db_manager.create_rollup_tables_if_not_exist():
+        logger.warning("Не удалось создать таблицы агрегатов")
+    elif RECOMPUTE_ROLLUPS:
+        db_manager.recompute_rollups()
+
+    # Журнал загруженных файлов
+    if not db_manager.create_loaded_files_table_if_not_exists():
+        logger.error("Не удалось создать журнал загруженных файлов")
+        return None
+
+    return db_manager
+
+
+def log_final_summary(db_manager, summary_before):
+    """Вывести итоговую сводку по данным в БД после загрузки"""
+    summary_after = db_manager.get_data_summary()
+    if summary_after:
+        logger.info("📊 ИТОГОВАЯ СВОДКА:")
+        logger.info(f"  Всего записей в БД: {summary_after['total_records']:,}")
+        logger.info(f"  Уникальных кампаний: {summary_after['unique_campaigns']:,}")
+        logger.info(f"  Уникальных аккаунтов: {summary_after['unique_accounts']:,}")
+        if summary_after['min_date'] and summary_after['max_date']:
+            logger.info(f"  Период данных: {summary_after['min_date']} - {summary_after['max_date']}")
+        logger.info(f"  Всего показов: {summary_after['total_impressions']:,}")
+        logger.info(f"  Всего кликов: {summary_after['total_clicks']:,}")
+        logger.info(f"  Общие расходы: ${summary_after['total_spend']:,.4f}")
+
+        if summary_before:
+            new_records = summary_after['total_records'] - summary_before['total_records']
+            logger.info(f"  📈 Добавлено новых записей: {new_records:,}")
+
+
+def main():
+    print("MINTEGRAL CSV TO DATABASE LOADER")
+    print("=" * 50)
+
+    # Подключение к БД и подготовка таблиц
+    db_manager = prepare_database()
+    if db_manager is None:
         return
 
-    # Поиск CSV файлов (только самый свежий)
+    # Поиск CSV файлов (все выгрузки, от старых к новым)
     csv_files = find_csv_files()
 
     if not csv_files:
@@ -400,7 +1941,7 @@ def main():
         logger.info("Ожидаемые файлы: mintegral_data_YYYYMMDD_HHMMSS.csv")
         return
 
-    logger.info(f"Найден файл для обработки: {csv_files[0]}")
+    logger.info(f"Найдено файлов для обработки: {len(csv_files)}")
 
     # Получаем сводку до загрузки
     summary_before = db_manager.get_data_summary()
@@ -409,66 +1950,25 @@ def main():
     else:
         logger.info("БД пуста")
 
-    # Обработка CSV файла (только один - самый свежий)
-    csv_file = csv_files[0]
+    # Обработка CSV файлов: уже загруженные пропускаются по журналу
+    statuses = [load_pending_csv_file(db_manager, csv_file) for csv_file in csv_files]
 
-    # Загружаем CSV
-    df = load_csv_file(csv_file)
-
-    if df.empty:
-        logger.error(f"Файл {csv_file} пуст или не удалось загрузить")
-        return
-
-    # Проверяем структуру
-    if not validate_csv_structure(df):
-        logger.error(f"Файл {csv_file} имеет неправильную структуру")
-        return
-
-    # Подготавливаем данные
-    df_prepared = prepare_dataframe_for_db(df)
-
-    if df_prepared.empty:
-        logger.warning(f"После обработки файл {csv_file} оказался пуст")
-        return
-
-    logger.info(f"Файл {csv_file} подготовлен: {len(df_prepared)} записей")
-
-    # Удаляем внутренние дубликаты в самом файле
-    before_dedup = len(df_prepared)
-    df_prepared = df_prepared.drop_duplicates(subset=['account_id', 'date', 'campaign_name'])
-    after_dedup = len(df_prepared)
-
-    if before_dedup != after_dedup:
-        logger.info(f"Удалено внутренних дубликатов в файле: {before_dedup - after_dedup}")
+    loaded_files = statuses.count('loaded')
+    failed_files = statuses.count('failed')
+    logger.info(f"Файлов загружено: {loaded_files}, пропущено (уже загружены): {statuses.count('skipped')}, "
+                f"с ошибками: {failed_files}")
 
-    logger.info(f"Итого записей для загрузки: {len(df_prepared)}")
+    if failed_files:
+        logger.error("❌ Ошибка загрузки данных в базу данных")
 
-    # Сохраняем в БД
-    if db_manager.save_dataframe(df_prepared):
+    if loaded_files:
         logger.info("✅ Данные успешно загружены в базу данных")
 
-        # Оптимизируем таблицу
-        db_manager.optimize_table()
+        # Обслуживание таблицы: перестройка только при необходимости, иначе обновление статистики
+        db_manager.run_maintenance()
 
         # Финальная сводка
-        summary_after = db_manager.get_data_summary()
-        if summary_after:
-            logger.info("📊 ИТОГОВАЯ СВОДКА:")
-            logger.info(f"  Всего записей в БД: {summary_after['total_records']:,}")
-            logger.info(f"  Уникальных кампаний: {summary_after['unique_campaigns']:,}")
-            logger.info(f"  Уникальных аккаунтов: {summary_after['unique_accounts']:,}")
-            if summary_after['min_date'] and summary_after['max_date']:
-                logger.info(f"  Период данных: {summary_after['min_date']} - {summary_after['max_date']}")
-            logger.info(f"  Всего показов: {summary_after['total_impressions']:,}")
-            logger.info(f"  Всего кликов: {summary_after['total_clicks']:,}")
-            logger.info(f"  Общие расходы: ${summary_after['total_spend']:,.4f}")
-
-            if summary_before:
-                new_records = summary_after['total_records'] - summary_before['total_records']
-                logger.info(f"  📈 Добавлено новых записей: {new_records:,}")
-
-    else:
-        logger.error("❌ Ошибка загрузки данных в базу данных")
+        log_final_summary(db_manager, summary_before)
 
     print("Загрузка завершена!")
 
@@ -1,9 +1,15 @@
+import os
+import json
 import time
+import random
+import threading
 import hashlib
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
 from datetime import datetime, timedelta
 from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -21,7 +27,7 @@ ACCOUNTS = [
         'active': True
     },
     {
-        'account_id': 1,
+        'account_id': 2,
         'account_name': 'Account_2',
         'api_key': 'your_api_key_here',
         'access_key': 'your_access_key_here',
@@ -34,11 +40,35 @@ GLOBAL_DATE_FROM = 'your_start_date_here'  # Дата начала выгруз
 GLOBAL_DATE_TO = 'your_end_date_here'  # Дата окончания (или '' для автоматического расчета до вчера)
 
 DEFAULT_TIMEZONE = '+3'
-MAX_RETRIES = 15
-RETRY_DELAY = 45
+RETRY_DELAY = 45  # Базовая пауза после ошибки запроса
 REQUEST_TIMEOUT = 120
 MAX_CONSECUTIVE_ERRORS = 3
 
+# Инкрементальная выгрузка: аккаунт выгружается с последней выгруженной даты
+# (с перезагрузкой RESTATEMENT_LOOKBACK_DAYS последних дней из-за поздней атрибуции), а не с GLOBAL_DATE_FROM.
+# Если GLOBAL_DATE_FROM перенесена раньше, чем в прошлой выгрузке, период выгружается полностью с нее (дозагрузка истории)
+INCREMENTAL_MODE = True
+RESTATEMENT_LOOKBACK_DAYS = 7
+EXPORT_STATE_FILE = 'mintegral_export_state.json'
+
+# Сколько аккаунтов обрабатывается одновременно
+MAX_PARALLEL_ACCOUNTS = 4
+
+# Размер пула HTTP-соединений (keep-alive) на аккаунт, можно переопределить ключом 'http_pool_size' в ACCOUNTS
+HTTP_POOL_SIZE = 4
+
+# Сколько отчетов аккаунта одновременно генерируется на сервере Mintegral
+MAX_PENDING_REPORTS = 8
+
+# Адаптивный опрос готовности отчета: короткий первый интервал, рост с джиттером и общий дедлайн.
+# Первый интервал берется из истории генерации отчетов аккаунта с тем же размером окна
+POLL_INITIAL_DELAY = 5
+POLL_BACKOFF_FACTOR = 1.5
+POLL_MAX_DELAY = 60
+POLL_JITTER = 0.2
+GENERATION_DEADLINE = 900  # Секунд на генерацию одного отчета
+GENERATION_STATS_FILE = 'mintegral_generation_stats.json'
+
 
 class MintegralAPIClient:
     def __init__(self, account_config: dict):
@@ -48,6 +78,17 @@ class MintegralAPIClient:
         self.access_key = account_config['access_key']
         self.active = account_config['active']
 
+        self.pool_size = account_config.get('http_pool_size', HTTP_POOL_SIZE)
+        self.session = create_http_session(self.pool_size)
+        self.session.headers.update({
+            'access-key': self.access_key,
+            'Content-Type': 'application/json'
+        })
+
+    def close(self):
+        """Закрыть HTTP-сессию и освободить соединения пула"""
+        self.session.close()
+
     def get_token(self):
         """Генерация токена для аутентификации"""
         timestamp = str(int(time.time()))
@@ -67,18 +108,17 @@ class MintegralAPIClient:
             'timezone': timezone
         }
 
+        # access-key передается через заголовки сессии, токен генерируется на каждый запрос
         token, timestamp = self.get_token()
         headers = {
-            'access-key': self.access_key,
             'token': token,
-            'timestamp': timestamp,
-            'Content-Type': 'application/json'
+            'timestamp': timestamp
         }
 
         url = 'https://ss-api.mintegral.com/api/v2/reports/data'
 
         try:
-            response = requests.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+            response = self.session.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
             return response
         except requests.exceptions.RequestException as e:
             logger.error(f"Ошибка запроса для {self.account_name}: {e}")
@@ -94,64 +134,30 @@ class MintegralAPIClient:
             logger.error(f"Ошибка тестирования API для {self.account_name}: {e}")
             return False
 
-    def wait_for_data_generation(self, start_date, end_date, dimension_option='Offer',
-                                 time_granularity='daily', max_retries=MAX_RETRIES):
-        """Ожидание генерации данных на сервере"""
-        consecutive_errors = 0
+    def check_generation_status(self, start_date, end_date, dimension_option='Offer', time_granularity='daily'):
+        """Запуск/проверка генерации отчета (type=1): 'ready', 'generating', 'error' или 'failed'"""
+        response = self.make_api_request(1, start_date, end_date, dimension_option, time_granularity)
 
-        for attempt in range(max_retries):
-            try:
-                response = self.make_api_request(1, start_date, end_date, dimension_option, time_granularity)
-
-                if not response:
-                    consecutive_errors += 1
-                    if consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
-                        return False
-                    if attempt < max_retries - 1:
-                        wait_time = RETRY_DELAY * (1 + consecutive_errors * 0.5)
-                        logger.info(f"Ожидание {wait_time}с перед повтором...")
-                        time.sleep(wait_time)
-                    continue
-
-                consecutive_errors = 0
-
-                if not response.ok:
-                    if attempt < max_retries - 1:
-                        logger.info(f"Ожидание генерации данных... попытка {attempt + 1}/{max_retries}")
-                        time.sleep(RETRY_DELAY)
-                    continue
-
-                try:
-                    data = response.json()
-                except:
-                    if attempt < max_retries - 1:
-                        time.sleep(RETRY_DELAY)
-                    continue
-
-                code = data.get('code')
-
-                if code == 200:
-                    logger.info(f"✅ Данные готовы для {self.account_name}")
-                    return True
-                elif code in [201, 202]:
-                    if attempt < max_retries - 1:
-                        logger.info(f"Генерация данных... попытка {attempt + 1}/{max_retries}")
-                        time.sleep(RETRY_DELAY)
-                    continue
-                else:
-                    logger.warning(f"❌ API вернул код {code} для {self.account_name}")
-                    return False
+        if not response:
+            return 'error'
 
-            except Exception as e:
-                consecutive_errors += 1
-                logger.warning(f"Ошибка при ожидании данных: {e}")
-                if consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
-                    return False
-                if attempt < max_retries - 1:
-                    wait_time = RETRY_DELAY * (1 + consecutive_errors * 0.5)
-                    time.sleep(wait_time)
+        if not response.ok:
+            return 'generating'
+
+        try:
+            data = response.json()
+        except ValueError:
+            return 'generating'
+
+        code = data.get('code')
 
-        return False
+        if code == 200:
+            return 'ready'
+        elif code in [201, 202]:
+            return 'generating'
+        else:
+            logger.warning(f"❌ API вернул код {code} для {self.account_name}")
+            return 'failed'
 
     def download_data(self, start_date, end_date, dimension_option='Offer', time_granularity='daily'):
         """Скачивание готовых данных"""
@@ -165,16 +171,6 @@ class MintegralAPIClient:
             return response.text
         return None
 
-    def get_data_for_period(self, start_date, end_date, dimension_option='Offer', time_granularity='daily'):
-        """Получение данных за период"""
-        logger.info(f"Получаем данные для {self.account_name} за {start_date} - {end_date}")
-
-        if not self.wait_for_data_generation(start_date, end_date, dimension_option, time_granularity):
-            logger.warning(f"❌ Не удалось получить данные для {self.account_name}")
-            return None
-
-        return self.download_data(start_date, end_date, dimension_option, time_granularity)
-
     def parse_data_to_dataframe(self, data_text):
         """Парсинг данных в DataFrame"""
         if not data_text or not data_text.strip():
@@ -188,6 +184,205 @@ class MintegralAPIClient:
             return None
 
 
+class GenerationLatencyStats:
+    """История времени генерации отчетов по аккаунту и размеру окна (скользящее среднее)"""
+
+    def __init__(self, path, smoothing=0.3):
+        self.path = path
+        self.smoothing = smoothing
+        self.stats = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Загрузить историю с диска (один раз, вызывается под блокировкой)"""
+        if self.stats is not None:
+            return
+
+        self.stats = {}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.stats = json.load(f)
+            except Exception as e:
+                logger.warning(f"Не удалось прочитать статистику генерации {self.path}: {e}")
+
+    def expected(self, account_id, window_days):
+        """Ожидаемое время генерации отчета в секундах (None - если истории нет)"""
+        with self.lock:
+            self.load()
+            entry = self.stats.get(f'{account_id}:{window_days}')
+            return entry['avg_seconds'] if entry else None
+
+    def record(self, account_id, window_days, seconds):
+        """Учесть наблюдаемое время генерации отчета"""
+        with self.lock:
+            self.load()
+            key = f'{account_id}:{window_days}'
+            entry = self.stats.get(key)
+
+            if entry:
+                entry['avg_seconds'] = round((1 - self.smoothing) * entry['avg_seconds'] + self.smoothing * seconds, 1)
+                entry['samples'] += 1
+            else:
+                self.stats[key] = {'avg_seconds': round(seconds, 1), 'samples': 1}
+
+            self.stats[key]['last_seconds'] = round(seconds, 1)
+
+    def save(self):
+        """Сохранить статистику на диск"""
+        if not self.path:
+            return
+
+        with self.lock:
+            if self.stats is None:
+                return
+
+            try:
+                tmp_path = f'{self.path}.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.stats, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить статистику генерации: {e}")
+
+
+generation_stats = GenerationLatencyStats(GENERATION_STATS_FILE)
+
+
+def get_window_days(start_date, end_date):
+    """Размер окна отчета в днях"""
+    return (datetime.strptime(end_date, '%Y-%m-%d') - datetime.strptime(start_date, '%Y-%m-%d')).days + 1
+
+
+def next_poll_delay(attempt, expected_seconds=None):
+    """Пауза перед следующим опросом готовности отчета после attempt выполненных опросов"""
+    # После запуска генерации ждем ожидаемое по истории время, дальше интервал растет
+    if attempt == 1 and expected_seconds:
+        delay = max(POLL_INITIAL_DELAY, expected_seconds)
+    else:
+        delay = POLL_INITIAL_DELAY * POLL_BACKOFF_FACTOR ** (attempt - 1)
+
+    delay = min(delay, POLL_MAX_DELAY)
+    return delay * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+
+class ReportScheduler:
+    """Конвейер отчетов: генерация запускается сразу по многим окнам, готовые отчеты скачиваются без ожидания остальных"""
+
+    def __init__(self, max_workers=HTTP_POOL_SIZE, max_pending=MAX_PENDING_REPORTS):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self.jobs = []
+
+    def submit(self, client, start_date, end_date, dimension_option='Offer', time_granularity='daily'):
+        """Добавить окно отчета в очередь"""
+        self.jobs.append({
+            'client': client,
+            'start_date': start_date,
+            'end_date': end_date,
+            'dimension_option': dimension_option,
+            'time_granularity': time_granularity,
+            'state': 'queued',
+            'attempts': 0,
+            'consecutive_errors': 0,
+            'next_poll_at': 0.0,
+            'started_at': None,
+            'data': None
+        })
+
+    def poll_job(self, job):
+        """Опросить статус генерации одного отчета и скачать его, если он готов"""
+        client = job['client']
+        period = f"{job['start_date']} - {job['end_date']}"
+
+        try:
+            status = client.check_generation_status(job['start_date'], job['end_date'],
+                                                    job['dimension_option'], job['time_granularity'])
+        except Exception as e:
+            logger.warning(f"Ошибка при ожидании данных за {period} для {client.account_name}: {e}")
+            status = 'error'
+
+        job['attempts'] += 1
+        window_days = get_window_days(job['start_date'], job['end_date'])
+
+        if status == 'ready':
+            elapsed = time.monotonic() - job['started_at']
+            generation_stats.record(client.account_id, window_days, elapsed)
+            logger.info(f"✅ Отчет за {period} для {client.account_name} готов за {elapsed:.0f}с")
+
+            job['data'] = client.download_data(job['start_date'], job['end_date'],
+                                               job['dimension_option'], job['time_granularity'])
+            job['state'] = 'done' if job['data'] else 'failed'
+            return
+
+        if status == 'failed':
+            job['state'] = 'failed'
+            return
+
+        if status == 'error':
+            job['consecutive_errors'] += 1
+            wait_time = RETRY_DELAY * (1 + job['consecutive_errors'] * 0.5)
+        else:
+            job['consecutive_errors'] = 0
+            wait_time = next_poll_delay(job['attempts'], generation_stats.expected(client.account_id, window_days))
+
+        elapsed = time.monotonic() - job['started_at']
+        if job['consecutive_errors'] >= MAX_CONSECUTIVE_ERRORS or elapsed + wait_time > GENERATION_DEADLINE:
+            logger.warning(f"❌ Отчет за {period} для {client.account_name} не сгенерирован")
+            job['state'] = 'failed'
+            return
+
+        job['next_poll_at'] = time.monotonic() + wait_time
+
+    def poll_job_safely(self, job):
+        """Опросить отчет; непредвиденная ошибка опроса или скачивания завершает неудачей только это окно"""
+        try:
+            self.poll_job(job)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки отчета за {job['start_date']} - {job['end_date']} "
+                         f"для {job['client'].account_name}: {e}")
+            job['state'] = 'failed'
+
+    def run(self):
+        """Выполнить все отчеты; возвращает данные отчетов в порядке добавления (None для неудачных)"""
+        queued = list(self.jobs)
+        active = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while queued or active:
+                # Запускаем генерацию новых окон, пока не достигнут лимит одновременно генерируемых отчетов
+                while queued and len(active) < self.max_pending:
+                    job = queued.pop(0)
+                    job['state'] = 'generating'
+                    job['started_at'] = time.monotonic()
+                    active.append(job)
+
+                now = time.monotonic()
+                due_jobs = [job for job in active if job['next_poll_at'] <= now]
+                list(executor.map(self.poll_job_safely, due_jobs))
+
+                active = [job for job in active if job['state'] == 'generating']
+                finished = len(self.jobs) - len(queued) - len(active)
+                if due_jobs:
+                    logger.info(f"Отчетов готово: {finished}/{len(self.jobs)}, в генерации: {len(active)}")
+
+                # Освободилось место - сразу запускаем следующие окна, иначе ждем ближайшего опроса
+                if active and not (queued and len(active) < self.max_pending):
+                    time.sleep(max(0.0, min(job['next_poll_at'] for job in active) - time.monotonic()))
+
+        generation_stats.save()
+        return [job['data'] if job['state'] == 'done' else None for job in self.jobs]
+
+
+def create_http_session(pool_size: int) -> requests.Session:
+    """Создать HTTP-сессию с пулом keep-alive соединений заданного размера"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
 def convert_date_format(date_str: str, from_format: str, to_format: str) -> str:
     """Конвертация формата даты"""
     try:
@@ -233,6 +428,12 @@ def transform_to_target_format(df, account_id, account_name):
     else:
         result_df['date'] = ''
 
+    # Идентификатор кампании (Offer ID) - по нему кампания однозначно определяется в БД
+    if 'Offer ID' in df.columns:
+        result_df['offer_id'] = pd.to_numeric(df['Offer ID'], errors='coerce').astype('Int64')
+    else:
+        result_df['offer_id'] = pd.NA
+
     # Название кампании
     if 'Offer Name' in df.columns:
         result_df['campaign_name'] = df['Offer Name']
@@ -262,8 +463,75 @@ def transform_to_target_format(df, account_id, account_name):
     return result_df.sort_values(['date', 'campaign_name']).reset_index(drop=True)
 
 
-def process_account(account_config: dict, start_date: str, end_date: str) -> pd.DataFrame:
-    """Обработка данных одного аккаунта"""
+def load_export_state() -> dict:
+    """Загрузить состояние выгрузки: начало периода прошлой выгрузки и последние выгруженные даты аккаунтов"""
+    empty_state = {'date_from': None, 'last_dates': {}}
+    if not os.path.exists(EXPORT_STATE_FILE):
+        return empty_state
+
+    try:
+        with open(EXPORT_STATE_FILE, 'r', encoding='utf-8') as f:
+            export_state = json.load(f)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать состояние выгрузки {EXPORT_STATE_FILE}: {e}")
+        return empty_state
+
+    # Старый формат состояния - только последние даты аккаунтов
+    if 'last_dates' not in export_state:
+        return {'date_from': None, 'last_dates': export_state}
+
+    return export_state
+
+
+def advance_last_dates(last_dates: dict, df: pd.DataFrame, watermark_limits: dict) -> dict:
+    """Новые последние выгруженные даты аккаунтов по выгруженным данным.
+
+    watermark_limits - последняя дата перед первым неудачным окном аккаунта: отметка ставится не дальше нее
+    (в том числе откатывается назад), чтобы неудачное окно попало в следующий инкрементальный запуск
+    """
+    new_last_dates = dict(last_dates)
+
+    if df.empty:
+        return new_last_dates
+
+    for account_id, max_date in df.groupby('account_id')['date'].max().items():
+        key = str(account_id)
+        limit = watermark_limits.get(key)
+
+        if limit is not None:
+            new_last_dates[key] = min(max_date, limit)
+        elif max_date > new_last_dates.get(key, ''):
+            # Дата только растет - перевыгрузка старого периода не откатывает отметку
+            new_last_dates[key] = max_date
+
+    return new_last_dates
+
+
+def save_export_state(export_state: dict):
+    """Сохранить состояние выгрузки"""
+    try:
+        tmp_path = f'{EXPORT_STATE_FILE}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(export_state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, EXPORT_STATE_FILE)
+        logger.info(f"Состояние выгрузки сохранено в {EXPORT_STATE_FILE}")
+    except Exception as e:
+        logger.error(f"Ошибка сохранения состояния выгрузки: {e}")
+
+
+def get_incremental_start_date(account_id, start_date: str, last_dates: dict) -> str:
+    """Начало периода аккаунта: день после последней выгруженной даты минус окно перезагрузки"""
+    last_date = last_dates.get(str(account_id))
+    if not last_date:
+        return start_date
+
+    start = datetime.strptime(last_date, '%Y-%m-%d') + timedelta(days=1 - RESTATEMENT_LOOKBACK_DAYS)
+    return max(start.strftime('%Y-%m-%d'), start_date)
+
+
+def process_account(account_config: dict, start_date: str, end_date: str,
+                    last_dates: dict = None) -> tuple:
+    """Обработка данных одного аккаунта; вернуть (DataFrame, последняя дата перед первым неудачным окном или None)"""
     account_name = account_config['account_name']
 
     logger.info(f"Обрабатываем аккаунт: {account_name}")
@@ -271,12 +539,24 @@ def process_account(account_config: dict, start_date: str, end_date: str) -> pd.
     # Проверяем активность аккаунта
     if not account_config.get('active', True):
         logger.warning(f"Аккаунт {account_name} отключен")
-        return pd.DataFrame()
+        return pd.DataFrame(), None
 
     # Проверяем наличие учетных данных
     if not account_config.get('api_key') or not account_config.get('access_key'):
         logger.error(f"Не указаны API_KEY/ACCESS_KEY для {account_name}")
-        return pd.DataFrame()
+        return pd.DataFrame(), None
+
+    # В инкрементальном режиме выгружаем только новые окна и окна внутри горизонта перезагрузки
+    if INCREMENTAL_MODE and last_dates:
+        start_date = get_incremental_start_date(account_config['account_id'], start_date, last_dates)
+
+        if start_date > end_date:
+            logger.info(f"Нет новых дней для выгрузки по {account_name}")
+            return pd.DataFrame(), None
+
+        logger.info(f"Инкрементальный период для {account_name}: {start_date} - {end_date}")
+
+    client = None
 
     try:
         # Инициализация клиента API
@@ -285,22 +565,28 @@ def process_account(account_config: dict, start_date: str, end_date: str) -> pd.
         # Тест подключения
         if not client.test_api_connection():
             logger.error(f"Ошибка подключения к API для {account_name}")
-            return pd.DataFrame()
+            return pd.DataFrame(), None
 
         # Разбиваем период на части (максимум 7 дней на запрос)
         date_ranges = split_date_range(start_date, end_date, days=7)
         logger.info(f"Период разбит на {len(date_ranges)} частей для {account_name}")
 
+        # Запускаем генерацию отчетов по всем окнам сразу, скачиваем по мере готовности
+        scheduler = ReportScheduler(max_workers=client.pool_size)
+        for period_start, period_end in date_ranges:
+            scheduler.submit(client, period_start, period_end, 'Offer', 'daily')
+
+        reports = scheduler.run()
+
         all_dataframes = []
         successful_periods = 0
         failed_periods = 0
+        first_failed_start = None
 
-        for i, (period_start, period_end) in enumerate(date_ranges, 1):
+        for i, ((period_start, period_end), data_text) in enumerate(zip(date_ranges, reports), 1):
             logger.info(f"[{i}/{len(date_ranges)}] Обрабатываем {period_start} - {period_end} для {account_name}")
 
             try:
-                data_text = client.get_data_for_period(period_start, period_end, 'Offer', 'daily')
-
                 if data_text:
                     df = client.parse_data_to_dataframe(data_text)
                     if df is not None:
@@ -309,49 +595,66 @@ def process_account(account_config: dict, start_date: str, end_date: str) -> pd.
                         all_dataframes.append(transformed_df)
                         successful_periods += 1
                         logger.info(f"✓ Получено {len(transformed_df)} записей")
-                    else:
-                        failed_periods += 1
-                        logger.warning(f"❌ Нет данных за период {period_start} - {period_end}")
+                        continue
+
+                    logger.warning(f"❌ Нет данных за период {period_start} - {period_end}")
                 else:
-                    failed_periods += 1
                     logger.warning(f"❌ Не удалось получить данные за период {period_start} - {period_end}")
 
             except Exception as e:
                 logger.error(f"Ошибка обработки периода {period_start} - {period_end}: {e}")
-                failed_periods += 1
+
+            failed_periods += 1
+            if first_failed_start is None:
+                first_failed_start = period_start
 
         logger.info(f"✅ Успешных периодов для {account_name}: {successful_periods}")
         logger.info(f"❌ Неудачных периодов для {account_name}: {failed_periods}")
 
+        # Отметка аккаунта не должна перескочить неудачное окно
+        watermark_limit = None
+        if first_failed_start is not None:
+            watermark_limit = (datetime.strptime(first_failed_start, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+            logger.warning(f"Отметка выгрузки {account_name} не сдвинется дальше {watermark_limit}")
+
         if all_dataframes:
             final_df = pd.concat(all_dataframes, ignore_index=True)
             logger.info(f"📊 Итого записей для {account_name}: {len(final_df)}")
-            return final_df
+            return final_df, watermark_limit
         else:
             logger.warning(f"Нет данных для {account_name}")
-            return pd.DataFrame()
+            return pd.DataFrame(), watermark_limit
 
     except Exception as e:
         logger.error(f"Ошибка обработки аккаунта {account_name}: {e}")
-        return pd.DataFrame()
+        return pd.DataFrame(), None
 
+    finally:
+        if client is not None:
+            client.close()
 
-def main():
-    print("MINTEGRAL DATA EXPORT TO CSV")
-    print("=" * 50)
 
+def export_data():
+    """Выгрузить данные всех активных аккаунтов; вернуть (DataFrame, новое состояние выгрузки для сохранения после загрузки) или (None, None) при ошибке настроек"""
     # Проверка конфигурации аккаунтов
     if not ACCOUNTS:
         logger.error("Не настроен ни один аккаунт!")
-        return
+        return None, None
 
     active_accounts = [a for a in ACCOUNTS if a.get('active', True)]
     if not active_accounts:
         logger.error("Нет активных аккаунтов!")
-        return
+        return None, None
 
     logger.info(f"Активных аккаунтов: {len(active_accounts)}")
 
+    # account_id - ключ состояния выгрузки и строк в БД, поэтому он должен быть уникальным
+    account_ids = [str(a['account_id']) for a in active_accounts]
+    duplicate_ids = sorted({account_id for account_id in account_ids if account_ids.count(account_id) > 1})
+    if duplicate_ids:
+        logger.error(f"Повторяющиеся account_id в ACCOUNTS: {', '.join(duplicate_ids)}")
+        return None, None
+
     # Определение периода
     start_date = GLOBAL_DATE_FROM
 
@@ -369,7 +672,7 @@ def main():
         logger.info(f"Глобальный период выгрузки: {start_date} - {end_date}")
     except ValueError:
         logger.error(f"Неверный формат глобальных дат! Используйте DD.MM.YYYY")
-        return
+        return None, None
 
     # Конвертируем даты в формат API
     api_date_from = convert_date_format(start_date, '%d.%m.%Y', '%Y-%m-%d')
@@ -377,40 +680,93 @@ def main():
 
     logger.info(f"API период: {api_date_from} - {api_date_to}")
 
-    # Обработка каждого аккаунта
+    # Последние выгруженные даты аккаунтов для инкрементальной выгрузки
+    export_state = load_export_state() if INCREMENTAL_MODE else {'date_from': None, 'last_dates': {}}
+    last_dates = export_state['last_dates']
+
+    # Явно перенесенная раньше GLOBAL_DATE_FROM важнее отметок: история дозагружается с нее
+    if last_dates and export_state['date_from'] and api_date_from < export_state['date_from']:
+        logger.info(f"GLOBAL_DATE_FROM раньше начала прошлой выгрузки ({export_state['date_from']}): "
+                    f"выгружаем весь период без учета отметок")
+        last_dates = {}
+
+    if last_dates:
+        logger.info(f"Инкрементальный режим: перезагружаем последние {RESTATEMENT_LOOKBACK_DAYS} дн.")
+
+    # Обработка аккаунтов параллельно, ошибка одного аккаунта не влияет на остальные
     all_dataframes = []
+    watermark_limits = {}
+    max_workers = min(MAX_PARALLEL_ACCOUNTS, len(active_accounts))
+    logger.info(f"Параллельно обрабатываемых аккаунтов: {max_workers}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process_account, account_config, api_date_from, api_date_to, last_dates)
+                   for account_config in active_accounts]
+
+        # Результаты объединяем в порядке ACCOUNTS
+        for account_config, future in zip(active_accounts, futures):
+            try:
+                df, watermark_limit = future.result()
+            except Exception as e:
+                logger.error(f"Ошибка обработки аккаунта {account_config['account_name']}: {e}")
+                continue
+
+            if watermark_limit is not None:
+                watermark_limits[str(account_config['account_id'])] = watermark_limit
 
-    for account_config in ACCOUNTS:
-        if account_config.get('active', True):
-            df = process_account(account_config, api_date_from, api_date_to)
             if not df.empty:
                 all_dataframes.append(df)
 
     # Объединяем все данные
-    if all_dataframes:
-        final_df = pd.concat(all_dataframes, ignore_index=True)
+    final_df = pd.concat(all_dataframes, ignore_index=True) if all_dataframes else pd.DataFrame()
+
+    new_state = {
+        'date_from': api_date_from,
+        'last_dates': advance_last_dates(last_dates, final_df, watermark_limits)
+    }
+    return final_df, new_state
 
-        # Сохраняем в CSV
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'mintegral_data_{timestamp}.csv'
 
-        final_df.to_csv(filename, index=False, encoding='utf-8')
+def save_to_csv(final_df: pd.DataFrame) -> str:
+    """Сохранить выгрузку в CSV; вернуть имя файла"""
+    # Сохраняем в CSV
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f'mintegral_data_{timestamp}.csv'
 
-        logger.info(f"✅ Данные сохранены в файл: {filename}")
-        logger.info(f"📊 Всего записей: {len(final_df)}")
-        logger.info(f"🏢 Уникальных аккаунтов: {final_df['account_name'].nunique()}")
-        logger.info(f"📋 Уникальных кампаний: {final_df['campaign_name'].nunique()}")
-        logger.info(f"📅 Период данных: {final_df['date'].min()} - {final_df['date'].max()}")
+    final_df.to_csv(filename, index=False, encoding='utf-8')
 
-        # Статистика по метрикам
-        total_impressions = final_df['impression'].sum()
-        total_clicks = final_df['clicks'].sum()
-        total_spend = final_df['spend_in_dollars'].sum()
-        logger.info(f"💰 Показов: {total_impressions:,}, Кликов: {total_clicks:,}, Расходы: ${total_spend:,.2f}")
+    logger.info(f"✅ Данные сохранены в файл: {filename}")
+    logger.info(f"📊 Всего записей: {len(final_df)}")
+    logger.info(f"🏢 Уникальных аккаунтов: {final_df['account_name'].nunique()}")
+    logger.info(f"📋 Уникальных кампаний: {final_df['campaign_name'].nunique()}")
+    logger.info(f"📅 Период данных: {final_df['date'].min()} - {final_df['date'].max()}")
 
-    else:
+    # Статистика по метрикам
+    total_impressions = final_df['impression'].sum()
+    total_clicks = final_df['clicks'].sum()
+    total_spend = final_df['spend_in_dollars'].sum()
+    logger.info(f"💰 Показов: {total_impressions:,}, Кликов: {total_clicks:,}, Расходы: ${total_spend:,.2f}")
+
+    return filename
+
+
+def main():
+    print("MINTEGRAL DATA EXPORT TO CSV")
+    print("=" * 50)
+
+    final_df, export_state = export_data()
+    if final_df is None:
+        return
+
+    if final_df.empty:
         logger.error("Нет данных для сохранения")
+        return
+
+    save_to_csv(final_df)
+
+    if INCREMENTAL_MODE:
+        save_export_state(export_state)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,66 @@
+import os
+import logging
+
+import mintegral_to_csv as exporter
+import mintegral_csv_to_db as loader
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Выгрузка передается в БД напрямую из памяти; CSV пишется только как архивная копия
+ARCHIVE_CSV = False
+
+
+def main():
+    print("MINTEGRAL DATA EXPORT TO DATABASE")
+    print("=" * 50)
+
+    # БД готовится до выгрузки: при недоступной БД запросы к API не выполняются
+    db_manager = loader.prepare_database()
+    if db_manager is None:
+        return
+
+    final_df, export_state = exporter.export_data()
+    if final_df is None:
+        return
+
+    if final_df.empty:
+        logger.error("Нет данных для загрузки")
+        return
+
+    archive_file = exporter.save_to_csv(final_df) if ARCHIVE_CSV else None
+
+    # Получаем сводку до загрузки
+    summary_before = db_manager.get_data_summary()
+    if summary_before:
+        logger.info(f"Записей в БД до загрузки: {summary_before['total_records']}")
+    else:
+        logger.info("БД пуста")
+
+    # Архивный файл отмечается в журнале в одной транзакции с данными: загрузчик CSV пропустит его
+    loaded_file = None
+    if archive_file:
+        loaded_file = {'file_name': os.path.basename(archive_file), 'content_hash': loader.compute_file_hash(archive_file)}
+
+    row_count = loader.load_dataframe(db_manager, final_df, "Выгрузка", loaded_file)
+    if row_count is None:
+        # Состояние выгрузки не сдвигается: следующий запуск выгрузит тот же период
+        logger.error("❌ Ошибка загрузки данных в базу данных")
+        return
+
+    logger.info("✅ Данные успешно загружены в базу данных")
+
+    if exporter.INCREMENTAL_MODE:
+        exporter.save_export_state(export_state)
+
+    # Обслуживание таблицы: перестройка только при необходимости, иначе обновление статистики
+    db_manager.run_maintenance()
+
+    # Финальная сводка
+    loader.log_final_summary(db_manager, summary_before)
+
+    print("Загрузка завершена!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Коннекторы - отдельные скрипты, а не пакеты: их папки добавляются в путь импорта
+CONNECTORS_DIR = os.path.join(os.path.dirname(__file__), '..', 'connectors')
+
+for connector in ('hybe', 'mintegral'):
+    sys.path.insert(0, os.path.join(CONNECTORS_DIR, connector))
@@ -0,0 +1,21 @@
+import pytest
+
+from hybe_to_csv import campaign_has_activity
+
+
+@pytest.mark.parametrize('stat, active', [
+    ({'ImpressionCount': 0, 'ClickCount': 0, 'SumWinningPrice': 0}, False),
+    ({'ImpressionCount': '0', 'ClickCount': '0', 'SumWinningPrice': '0.00'}, False),
+    ({'ImpressionCount': 0, 'ClickCount': 0, 'SumWinningPrice': 0.01}, True),
+    ({'ImpressionCount': 12, 'ClickCount': None}, True),
+    ({'ImpressionCount': 0, 'ClickCount': None, 'SumWinningPrice': None}, False),
+], ids=['zeros', 'zero-strings', 'spend-only', 'impressions', 'zeros-with-missing'])
+def test_activity_by_totals(stat, active):
+    assert campaign_has_activity(stat) is active
+
+
+@pytest.mark.parametrize('stat', [{}, {'CampaignId': '1'}, {'ImpressionCount': 'n/a', 'ClickCount': 0}],
+                         ids=['empty', 'no-totals', 'unparsable'])
+def test_campaign_without_usable_totals_is_kept(stat):
+    # Кампания без итогов в ответе не пропускается, чтобы не потерять данные
+    assert campaign_has_activity(stat) is True
@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+
+import hybe_csv_to_db
+import mintegral_csv_to_db
+
+
+@pytest.fixture(params=[hybe_csv_to_db, mintegral_csv_to_db], ids=['hybe', 'mintegral'])
+def loader(request):
+    return request.param
+
+
+def make_chunk(loader, rows):
+    """Порция с натуральным ключом loader.KEY_COLUMNS; rows - список (группа, кампания, дата, клики)"""
+    group_column = loader.KEY_COLUMNS[0]
+    return pd.DataFrame([{group_column: group, 'campaign_key': campaign, 'date': date, 'clicks': clicks}
+                         for group, campaign, date, clicks in rows])
+
+
+def test_first_occurrence_wins_within_and_across_chunks(loader):
+    seen_keys = set()
+
+    first = loader.drop_keys_seen_in_file(make_chunk(loader, [
+        (1, 1, '2024-01-01', 10),
+        (1, 1, '2024-01-01', 99),
+        (1, 2, '2024-01-01', 20),
+    ]), seen_keys)
+    second = loader.drop_keys_seen_in_file(make_chunk(loader, [
+        (1, 2, '2024-01-01', 99),
+        (2, 1, '2024-01-01', 30),
+    ]), seen_keys)
+
+    assert first['clicks'].tolist() == [10, 20]
+    assert second['clicks'].tolist() == [30]
+    assert len(seen_keys) == 3
+
+
+def test_rows_differing_in_any_key_column_are_kept(loader):
+    chunk = make_chunk(loader, [
+        (1, 1, '2024-01-01', 1),
+        (2, 1, '2024-01-01', 2),
+        (1, 2, '2024-01-01', 3),
+        (1, 1, '2024-01-02', 4),
+    ])
+
+    assert len(loader.drop_keys_seen_in_file(chunk, set())) == 4
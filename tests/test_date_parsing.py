@@ -0,0 +1,81 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import hybe_csv_to_db
+import mintegral_csv_to_db
+
+
+def baseline_parse_date(date_str, date_formats):
+    """Построчный парсер дат до перехода на векторный (эталон для сравнения)"""
+    if pd.isna(date_str) or date_str == '':
+        return None
+
+    for fmt in date_formats:
+        try:
+            return datetime.strptime(str(date_str), fmt).date()
+        except ValueError:
+            continue
+
+    return None
+
+
+DATES = [
+    '2025-01-01',
+    '2025-1-5',
+    '01.02.2025',
+    '31/12/2024',
+    '2024/02/29',
+    '05-06-2025',
+    '2025-02-03T00:00:00',
+    '2925-01-01',
+    '9999-12-31',
+    '0001-01-01',
+    '2025-02-30',
+    '2025-13-01',
+    'not a date',
+    '',
+    None,
+]
+
+
+@pytest.mark.parametrize('loader', [hybe_csv_to_db, mintegral_csv_to_db])
+def test_parse_date_series_matches_baseline(loader):
+    dates = pd.Series(DATES, dtype=object)
+
+    parsed = loader.parse_date_series(dates)
+
+    expected = [baseline_parse_date(value, loader.DATE_FORMATS) for value in DATES]
+    assert [None if pd.isna(value) else value for value in parsed] == expected
+
+
+@pytest.mark.parametrize('loader', [hybe_csv_to_db, mintegral_csv_to_db])
+def test_parse_date_series_keeps_out_of_range_dates_in_mixed_column(loader):
+    dates = pd.Series(['9999-12-31', '01.01.2025', '2025-01-02', 'bad'] * 3, index=range(10, 22))
+
+    parsed = loader.parse_date_series(dates)
+
+    assert list(parsed.index) == list(dates.index)
+    assert parsed.iloc[0] == datetime(9999, 12, 31).date()
+    assert parsed.iloc[1] == datetime(2025, 1, 1).date()
+    assert parsed.iloc[2] == datetime(2025, 1, 2).date()
+    assert pd.isna(parsed.iloc[3])
+
+
+def test_prepare_dataframe_for_db_drops_only_invalid_dates():
+    df = pd.DataFrame({
+        'cabinet_id': [1, 1, 1],
+        'cabinet_name': ['C', 'C', 'C'],
+        'advertiser_name': ['A', 'A', 'A'],
+        'campaign_name': ['Camp', 'Camp', 'Camp'],
+        'campaign_id': ['c1', 'c2', 'c3'],
+        'date': ['9999-12-31', 'bad', '2025-01-01'],
+        'impressions': [1, 2, 3],
+        'clicks': [0, 0, 0],
+        'spend_in_rub': [1.0, 2.0, 3.0],
+    })
+
+    prepared = hybe_csv_to_db.prepare_dataframe_for_db(df)
+
+    assert list(prepared['campaign_id']) == ['c1', 'c3']
@@ -0,0 +1,109 @@
+import pandas as pd
+import pytest
+
+import hybe_to_csv
+import mintegral_to_csv
+
+
+@pytest.fixture(params=[(hybe_to_csv, 'cabinet_id'), (mintegral_to_csv, 'account_id')], ids=['hybe', 'mintegral'])
+def exporter(request):
+    return request.param
+
+
+def test_advance_last_dates_stops_before_failed_period(exporter):
+    module, id_column = exporter
+    df = pd.DataFrame({
+        id_column: [1, 1, 2],
+        'date': ['2024-01-03', '2024-01-20', '2024-01-10']
+    })
+    last_dates = {'1': '2024-01-01', '2': '2024-01-12'}
+
+    new_last_dates = module.advance_last_dates(last_dates, df, {'1': '2024-01-06'})
+
+    assert new_last_dates == {'1': '2024-01-06', '2': '2024-01-12'}
+    # Исходное состояние не меняется до успешной загрузки
+    assert last_dates == {'1': '2024-01-01', '2': '2024-01-12'}
+
+
+def test_advance_last_dates_moves_back_to_failed_period(exporter):
+    module, id_column = exporter
+    df = pd.DataFrame({id_column: [1], 'date': ['2024-01-20']})
+
+    new_last_dates = module.advance_last_dates({'1': '2024-01-10'}, df, {'1': '2024-01-08'})
+
+    assert new_last_dates == {'1': '2024-01-08'}
+
+
+def test_incremental_start_date_rewinds_by_restatement_window(exporter, monkeypatch):
+    module, _ = exporter
+    monkeypatch.setattr(module, 'RESTATEMENT_LOOKBACK_DAYS', 3)
+
+    assert module.get_incremental_start_date(1, '2024-01-01', {'1': '2024-03-01'}) == '2024-02-28'
+
+
+def test_incremental_start_date_never_precedes_date_from(exporter, monkeypatch):
+    module, _ = exporter
+    monkeypatch.setattr(module, 'RESTATEMENT_LOOKBACK_DAYS', 3)
+
+    assert module.get_incremental_start_date(1, '2024-02-29', {'1': '2024-03-01'}) == '2024-02-29'
+    # Без сохраненной даты период начинается с date_from
+    assert module.get_incremental_start_date(2, '2024-01-01', {'1': '2024-03-01'}) == '2024-01-01'
+
+
+def test_export_data_ignores_last_dates_when_date_from_moved_earlier(exporter, monkeypatch):
+    module, id_column = exporter
+    config_name, process_name = {
+        hybe_to_csv: ('CABINETS', 'process_cabinet'),
+        mintegral_to_csv: ('ACCOUNTS', 'process_account')
+    }[module]
+    monkeypatch.setattr(module, config_name, [{id_column: 1, 'active': True}])
+    monkeypatch.setattr(module, 'GLOBAL_DATE_FROM', '01.01.2024')
+    monkeypatch.setattr(module, 'GLOBAL_DATE_TO', '31.01.2024')
+    monkeypatch.setattr(module, 'INCREMENTAL_MODE', True)
+    monkeypatch.setattr(module, 'load_export_state',
+                        lambda: {'date_from': '2024-01-15', 'last_dates': {'1': '2024-01-30'}})
+
+    seen_last_dates = []
+
+    def fake_process(config, *args):
+        seen_last_dates.append(args[-1])
+        return pd.DataFrame({id_column: [1], 'date': ['2024-01-31']}), None
+
+    monkeypatch.setattr(module, process_name, fake_process)
+
+    _, new_state = module.export_data()
+
+    assert seen_last_dates == [{}]
+    assert new_state == {'date_from': '2024-01-01', 'last_dates': {'1': '2024-01-31'}}
+
+
+def test_load_export_state_reads_legacy_format(exporter, tmp_path, monkeypatch):
+    module, _ = exporter
+    state_file = tmp_path / 'state.json'
+    state_file.write_text('{"1": "2024-01-10"}', encoding='utf-8')
+    monkeypatch.setattr(module, 'EXPORT_STATE_FILE', str(state_file))
+
+    assert module.load_export_state() == {'date_from': None, 'last_dates': {'1': '2024-01-10'}}
+
+
+def test_mintegral_export_data_rejects_duplicate_account_ids(monkeypatch):
+    accounts = [
+        {'account_id': 1, 'account_name': 'Account_1', 'api_key': 'a', 'access_key': 'b'},
+        {'account_id': 1, 'account_name': 'Account_2', 'api_key': 'a', 'access_key': 'b'}
+    ]
+    monkeypatch.setattr(mintegral_to_csv, 'ACCOUNTS', accounts)
+
+    assert mintegral_to_csv.export_data() == (None, None)
+
+
+def test_hybe_watermark_limit_is_day_before_first_failed_period():
+    client = hybe_to_csv.HybeAPIClient({
+        'cabinet_id': 1, 'cabinet_name': 'Cabinet_1', 'client_id': 'a', 'client_secret': 'b', 'active': True
+    })
+    try:
+        assert client.get_watermark_limit() is None
+
+        client.failed_periods.extend([('2024-03-01', '2024-03-31'), ('2024-02-10', '2024-02-10')])
+        assert client.get_watermark_limit() == '2024-02-09'
+    finally:
+        client.close()
@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+import hybe_csv_to_db
+import mintegral_csv_to_db
+
+
+class RecordingManager:
+    """Подменяет запросы DatabaseManager записью вызовов; транзакции - настоящие (SQLite в памяти)"""
+
+    def __init__(self, loader, monkeypatch):
+        self.calls = []
+        self.manager = loader.DatabaseManager()
+        self.manager.engine = create_engine('sqlite://')
+
+        for name in ('create_staging_table', 'drop_staging_table', 'apply_summary_delta', 'refresh_rollups'):
+            monkeypatch.setattr(self.manager, name, self.recorder(name))
+
+        monkeypatch.setattr(self.manager, 'write_dataframe',
+                            lambda df, table: self.calls.append(('write_dataframe', len(df))))
+        monkeypatch.setattr(self.manager, 'merge_staging_table',
+                            lambda connection, columns: self.calls.append(('merge_staging_table',)) or 0)
+        monkeypatch.setattr(self.manager, 'insert_loaded_file',
+                            lambda connection, loaded_file: self.calls.append(('insert_loaded_file', loaded_file)))
+
+    def recorder(self, name):
+        return lambda *args: self.calls.append((name,))
+
+
+@pytest.fixture(params=[(hybe_csv_to_db, 'cabinet_id'), (mintegral_csv_to_db, 'account_id')],
+                ids=['hybe', 'mintegral'])
+def loader(request, monkeypatch):
+    module, group_column = request.param
+    monkeypatch.setattr(module, 'USE_STAGING_TABLE', True)
+    return module, group_column
+
+
+def make_chunk(group_column, dates):
+    return pd.DataFrame({group_column: [1] * len(dates), 'campaign_key': [1] * len(dates), 'date': dates})
+
+
+def test_chunks_are_merged_once_with_manifest_last(loader, monkeypatch):
+    module, group_column = loader
+    recording = RecordingManager(module, monkeypatch)
+    chunks = [make_chunk(group_column, ['2024-01-01', '2024-01-02']), make_chunk(group_column, ['2024-01-03'])]
+
+    row_count = recording.manager.save_dataframes(iter(chunks), {'file_name': 'a.csv', 'content_hash': 'h'})
+
+    assert row_count == 3
+    assert [call[0] for call in recording.calls] == [
+        'create_staging_table', 'write_dataframe', 'write_dataframe',
+        'apply_summary_delta', 'merge_staging_table', 'refresh_rollups', 'insert_loaded_file',
+        'drop_staging_table'
+    ]
+    assert recording.calls[-2][1] == {'file_name': 'a.csv', 'content_hash': 'h', 'row_count': 3}
+
+
+def test_failed_chunk_leaves_neither_data_nor_manifest(loader, monkeypatch):
+    module, group_column = loader
+    recording = RecordingManager(module, monkeypatch)
+
+    def chunks():
+        yield make_chunk(group_column, ['2024-01-01'])
+        raise ValueError('битая порция')
+
+    row_count = recording.manager.save_dataframes(chunks(), {'file_name': 'a.csv', 'content_hash': 'h'})
+
+    assert row_count is None
+    assert [call[0] for call in recording.calls] == ['create_staging_table', 'write_dataframe', 'drop_staging_table']
+
+
+def test_date_bounds_keep_first_and_last_date_per_group(loader):
+    module, group_column = loader
+    df = pd.DataFrame({group_column: [1, 1, 1, 2], 'date': ['2024-01-05', '2024-01-01', '2024-01-09', '2024-02-01']})
+
+    bounds = module.get_date_bounds(df)
+
+    assert bounds.groupby(group_column)['date'].agg(['min', 'max']).to_dict('index') == {
+        1: {'min': '2024-01-01', 'max': '2024-01-09'},
+        2: {'min': '2024-02-01', 'max': '2024-02-01'},
+    }
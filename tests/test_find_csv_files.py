@@ -0,0 +1,22 @@
+import pytest
+
+import hybe_csv_to_db
+import mintegral_csv_to_db
+
+
+@pytest.mark.parametrize('module, prefix', [(hybe_csv_to_db, 'hybe'), (mintegral_csv_to_db, 'mintegral')],
+                         ids=['hybe', 'mintegral'])
+def test_all_own_files_in_export_order_without_foreign_csv(module, prefix, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in (f'{prefix}_data_20240102_000000.csv', f'{prefix}_data_20240101_120000.csv', 'report.csv'):
+        (tmp_path / name).write_text('')
+
+    assert module.find_csv_files() == [f'{prefix}_data_20240101_120000.csv', f'{prefix}_data_20240102_000000.csv']
+
+
+@pytest.mark.parametrize('module', [hybe_csv_to_db, mintegral_csv_to_db], ids=['hybe', 'mintegral'])
+def test_foreign_csv_is_not_picked_up(module, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'report.csv').write_text('')
+
+    assert module.find_csv_files() == []
@@ -0,0 +1,17 @@
+import hybe_to_csv
+
+
+def test_hybe_mapping_is_built_once_without_cache(monkeypatch):
+    monkeypatch.setattr(hybe_to_csv, 'CAMPAIGN_CACHE_DIR', '')
+    client = hybe_to_csv.HybeAPIClient({
+        'cabinet_id': 1, 'cabinet_name': 'Cabinet_1', 'client_id': 'a', 'client_secret': 'b', 'active': True
+    })
+    builds = []
+    monkeypatch.setattr(client, 'build_campaign_mapping', lambda: builds.append(1) or {})
+    try:
+        campaign_mapping = client.get_campaign_mapping()
+        client.refresh_campaign_mapping(campaign_mapping, ['missing'])
+
+        assert builds == [1]
+    finally:
+        client.close()
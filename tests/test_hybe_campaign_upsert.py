@@ -0,0 +1,45 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.dialects.mysql import pymysql as mysql_pymysql
+
+pymysql = pytest.importorskip('pymysql')
+
+import hybe_csv_to_db  # noqa: E402
+
+
+class RecordingCursor(pymysql.cursors.Cursor):
+    """Курсор pymysql без сервера: запоминает итоговый SQL вместо отправки"""
+
+    def __init__(self, connection):
+        super().__init__(connection)
+        self.statements = []
+
+    def execute(self, query, args=None):
+        query = self.mogrify(query, args) if args is not None else query
+        self.statements.append(query.decode() if isinstance(query, (bytes, bytearray)) else query)
+        return 1
+
+
+@pytest.mark.parametrize('update_name', [True, False])
+def test_campaign_upsert_executemany_binds_every_row(update_name):
+    dialect = mysql_pymysql.dialect()
+    compiled = text(hybe_csv_to_db.campaign_upsert_sql(update_name)).compile(dialect=dialect)
+    rows = [
+        {'cabinet_id': 1, 'campaign_id': 'c1', 'advertiser_key': 10, 'campaign_name': 'Camp 1'},
+        {'cabinet_id': 1, 'campaign_id': 'c2', 'advertiser_key': None, 'campaign_name': "Camp '2'"},
+        {'cabinet_id': 2, 'campaign_id': 'c3', 'advertiser_key': 11, 'campaign_name': 'Camp 3'},
+    ]
+
+    connection = pymysql.connections.Connection(defer_connect=True, charset='utf8mb4')
+    connection.server_status = 0
+    cursor = RecordingCursor(connection)
+    # Как SQLAlchemy с pymysql: позиционные параметры %s в порядке их появления в запросе
+    cursor.executemany(str(compiled), [tuple(row[name] for name in compiled.positiontup) for row in rows])
+
+    # Быстрый путь executemany: одна многострочная вставка со всеми строками
+    assert len(cursor.statements) == 1
+    statement = cursor.statements[0]
+    assert '%s' not in statement
+    assert "(1, 'c1', 10, 'Camp 1'),(1, 'c2', NULL, 'Camp \\'2\\''),(2, 'c3', 11, 'Camp 3')" in statement
+    assert 'ON DUPLICATE KEY UPDATE' in statement
+    assert ('campaign_name = VALUES(campaign_name)' in statement) == update_name
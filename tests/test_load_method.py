@@ -0,0 +1,21 @@
+import pandas as pd
+import pytest
+
+import hybe_csv_to_db
+import mintegral_csv_to_db
+
+
+@pytest.mark.parametrize('module', [hybe_csv_to_db, mintegral_csv_to_db], ids=['hybe', 'mintegral'])
+def test_load_method_argument_overrides_manager_method(module, monkeypatch):
+    manager = module.DatabaseManager('insert')
+    calls = []
+    monkeypatch.setattr(manager, 'bulk_load_dataframe', lambda df, table: calls.append(table) or len(df))
+
+    assert manager.write_partition(pd.DataFrame({'a': [1, 2]}), 'benchmark', 'infile') == 2
+    assert calls == ['benchmark']
+
+
+@pytest.mark.parametrize('module', [hybe_csv_to_db, mintegral_csv_to_db], ids=['hybe', 'mintegral'])
+def test_manager_defaults_to_configured_load_method(module):
+    assert module.DatabaseManager().load_method == module.LOAD_METHOD
+    assert module.DatabaseManager('infile').load_method == 'infile'
@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+
+import hybe_csv_to_db
+import mintegral_csv_to_db
+
+
+@pytest.fixture(params=[hybe_csv_to_db, mintegral_csv_to_db], ids=['hybe', 'mintegral'])
+def loader(request):
+    return request.param
+
+
+def make_dataframe(loader, group_sizes):
+    rows = [{loader.PARTITION_COLUMN: group, 'date': pd.Timestamp('2024-01-01') + pd.Timedelta(days=day)}
+            for group, size in group_sizes.items() for day in reversed(range(size))]
+    return pd.DataFrame(rows)
+
+
+def test_partitions_cover_every_row_once(loader):
+    df = make_dataframe(loader, {1: 50, 2: 3, 3: 3, 4: 20})
+
+    partitions = loader.split_into_partitions(df, 4)
+
+    assert sum(len(partition) for partition in partitions) == len(df)
+    assert sorted(pd.concat(partitions).index) == sorted(df.index)
+    # Остаток группы добирается следующей группой: партиция меньше двух целевых размеров (19 записей)
+    assert all(len(partition) < 2 * 19 for partition in partitions)
+
+
+def test_large_group_is_split_by_contiguous_date_ranges(loader):
+    df = make_dataframe(loader, {1: 40})
+
+    partitions = loader.split_into_partitions(df, 4)
+
+    assert [len(partition) for partition in partitions] == [10, 10, 10, 10]
+    for previous, following in zip(partitions, partitions[1:]):
+        assert previous['date'].max() < following['date'].min()
+
+
+def test_small_groups_are_combined(loader):
+    df = make_dataframe(loader, {group: 2 for group in range(1, 9)})
+
+    partitions = loader.split_into_partitions(df, 2)
+
+    assert len(partitions) == 2
+    assert [partition[loader.PARTITION_COLUMN].nunique() for partition in partitions] == [4, 4]
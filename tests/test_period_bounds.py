@@ -0,0 +1,29 @@
+from datetime import date
+
+import pytest
+
+import hybe_csv_to_db
+import mintegral_csv_to_db
+
+
+@pytest.fixture(params=[hybe_csv_to_db, mintegral_csv_to_db], ids=['hybe', 'mintegral'])
+def loader(request):
+    return request.param
+
+
+@pytest.mark.parametrize('date_from, date_to, expected', [
+    (date(2024, 1, 3), date(2024, 1, 3), (date(2024, 1, 1), date(2024, 1, 7))),
+    (date(2024, 1, 1), date(2024, 1, 7), (date(2024, 1, 1), date(2024, 1, 7))),
+    (date(2023, 12, 31), date(2024, 1, 8), (date(2023, 12, 25), date(2024, 1, 14))),
+], ids=['inside-week', 'whole-week', 'across-year'])
+def test_week_bounds_start_on_monday(loader, date_from, date_to, expected):
+    assert loader.get_period_bounds('week', date_from, date_to) == expected
+
+
+@pytest.mark.parametrize('date_from, date_to, expected', [
+    (date(2024, 2, 10), date(2024, 2, 10), (date(2024, 2, 1), date(2024, 2, 29))),
+    (date(2023, 2, 1), date(2023, 2, 28), (date(2023, 2, 1), date(2023, 2, 28))),
+    (date(2024, 11, 30), date(2024, 12, 1), (date(2024, 11, 1), date(2024, 12, 31))),
+], ids=['leap-february', 'whole-month', 'across-months'])
+def test_month_bounds_are_calendar_months(loader, date_from, date_to, expected):
+    assert loader.get_period_bounds('month', date_from, date_to) == expected
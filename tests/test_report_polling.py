@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+import mintegral_to_csv
+from mintegral_to_csv import GenerationLatencyStats, next_poll_delay
+
+
+@pytest.fixture
+def no_jitter(monkeypatch):
+    monkeypatch.setattr(mintegral_to_csv, 'POLL_JITTER', 0)
+
+
+def test_poll_delay_grows_up_to_maximum(no_jitter):
+    delays = [next_poll_delay(attempt) for attempt in range(1, 20)]
+
+    assert delays[0] == mintegral_to_csv.POLL_INITIAL_DELAY
+    assert delays == sorted(delays)
+    assert delays[-1] == mintegral_to_csv.POLL_MAX_DELAY
+
+
+def test_first_poll_waits_expected_generation_time(no_jitter):
+    assert next_poll_delay(1, expected_seconds=30) == 30
+    assert next_poll_delay(1, expected_seconds=1) == mintegral_to_csv.POLL_INITIAL_DELAY
+    assert next_poll_delay(1, expected_seconds=3600) == mintegral_to_csv.POLL_MAX_DELAY
+
+    # История учитывается только до первого опроса
+    assert next_poll_delay(2, expected_seconds=30) == next_poll_delay(2)
+
+
+def test_poll_delay_jitter_stays_within_bounds():
+    base = mintegral_to_csv.POLL_INITIAL_DELAY
+    jitter = mintegral_to_csv.POLL_JITTER
+
+    for _ in range(100):
+        assert base * (1 - jitter) <= next_poll_delay(1) <= base * (1 + jitter)
+
+
+def test_latency_stats_smooth_observations_and_survive_reload(tmp_path):
+    path = tmp_path / 'stats.json'
+    stats = GenerationLatencyStats(str(path), smoothing=0.5)
+
+    assert stats.expected(1, 7) is None
+
+    stats.record(1, 7, 10)
+    stats.record(1, 7, 20)
+    stats.record(2, 7, 40)
+    stats.save()
+
+    assert stats.expected(1, 7) == 15
+    assert json.loads(path.read_text(encoding='utf-8'))['1:7'] == {'avg_seconds': 15, 'samples': 2, 'last_seconds': 20}
+
+    reloaded = GenerationLatencyStats(str(path))
+    assert reloaded.expected(1, 7) == 15
+    assert reloaded.expected(2, 7) == 40
+    assert reloaded.expected(1, 30) is None
+
+
+def test_latency_stats_ignore_unreadable_file(tmp_path):
+    path = tmp_path / 'stats.json'
+    path.write_text('{', encoding='utf-8')
+
+    assert GenerationLatencyStats(str(path)).expected(1, 7) is None
@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+import hybe_csv_to_db
+import mintegral_csv_to_db
+
+
+@pytest.fixture(params=[
+    (hybe_csv_to_db, 'cabinet_id', ['impressions', 'clicks', 'spend_in_rub']),
+    (mintegral_csv_to_db, 'account_id', ['impression', 'clicks', 'spend_in_dollars']),
+], ids=['hybe', 'mintegral'])
+def loader(request):
+    return request.param
+
+
+def test_summary_delta_counts_new_rows_and_metric_differences(loader):
+    module, group_column, metrics = loader
+    manager = module.DatabaseManager()
+    manager.engine = create_engine('sqlite://')
+
+    existing = pd.DataFrame({
+        group_column: [1, 1],
+        'campaign_key': [10, 10],
+        'date': ['2024-01-01', '2024-01-02'],
+        metrics[0]: [100, 50],
+        metrics[1]: [10, 5],
+        metrics[2]: [1.5, 0.5],
+    })
+    existing.to_sql(module.TABLE, manager.engine, index=False)
+
+    # Одна запись обновляется, две - новые (в том числе по новой кампании второй группы)
+    df = pd.DataFrame({
+        group_column: [1, 1, 2],
+        'campaign_key': [10, 10, 20],
+        'date': ['2024-01-02', '2024-01-03', '2024-01-03'],
+        metrics[0]: [80, 7, 3],
+        metrics[1]: [8, 1, 1],
+        metrics[2]: [0.75, 0.25, 2.0],
+    })
+
+    summary_delta = manager.get_summary_delta(df)
+
+    assert summary_delta['rows'] == [
+        {group_column: 1, 'total_records': 1, 'min_date': '2024-01-02', 'max_date': '2024-01-03',
+         'total_impressions': 37, 'total_clicks': 4, 'total_spend': 0.5},
+        {group_column: 2, 'total_records': 1, 'min_date': '2024-01-03', 'max_date': '2024-01-03',
+         'total_impressions': 3, 'total_clicks': 1, 'total_spend': 2.0},
+    ]
+    assert summary_delta['campaigns'] == [
+        {group_column: 1, 'campaign_key': 10},
+        {group_column: 2, 'campaign_key': 20},
+    ]
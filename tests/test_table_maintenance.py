@@ -0,0 +1,57 @@
+from datetime import datetime
+
+import pytest
+
+import mintegral_csv_to_db
+from mintegral_csv_to_db import should_analyze_table, should_optimize_table
+
+MB = 1024 ** 2
+NOW = datetime(2024, 6, 1, 3, 0)
+
+
+@pytest.fixture(autouse=True)
+def maintenance_settings(monkeypatch):
+    monkeypatch.setattr(mintegral_csv_to_db, 'OPTIMIZE_FRAGMENTATION_THRESHOLD', 0.2)
+    monkeypatch.setattr(mintegral_csv_to_db, 'OPTIMIZE_MIN_FREE_MB', 100)
+    monkeypatch.setattr(mintegral_csv_to_db, 'OPTIMIZE_MIN_INTERVAL_HOURS', 24)
+    monkeypatch.setattr(mintegral_csv_to_db, 'OPTIMIZE_ALLOWED_HOURS', None)
+    monkeypatch.setattr(mintegral_csv_to_db, 'ANALYZE_CHANGED_ROWS_THRESHOLD', 0.1)
+    monkeypatch.setattr(mintegral_csv_to_db, 'ANALYZE_MIN_INTERVAL_HOURS', 24)
+
+
+def make_stats(data_free_mb=300, fragmentation=0.3, file_per_table=True, table_rows=1000):
+    return {'data_free': data_free_mb * MB, 'fragmentation': fragmentation,
+            'file_per_table': file_per_table, 'table_rows': table_rows}
+
+
+def test_optimize_when_fragmented_and_interval_passed():
+    assert should_optimize_table(make_stats(), None, NOW)
+    assert should_optimize_table(make_stats(), '2024-05-31T02:00:00', NOW)
+
+
+@pytest.mark.parametrize('stats, last_optimized_at', [
+    (make_stats(fragmentation=0.1), None),
+    (make_stats(data_free_mb=50), None),
+    (make_stats(file_per_table=False), None),
+    (make_stats(), '2024-05-31T12:00:00'),
+], ids=['low-fragmentation', 'little-free-space', 'shared-tablespace', 'too-soon'])
+def test_optimize_skipped(stats, last_optimized_at):
+    assert not should_optimize_table(stats, last_optimized_at, NOW)
+
+
+def test_optimize_only_in_allowed_hours(monkeypatch):
+    monkeypatch.setattr(mintegral_csv_to_db, 'OPTIMIZE_ALLOWED_HOURS', range(1, 6))
+
+    assert should_optimize_table(make_stats(), None, NOW)
+    assert not should_optimize_table(make_stats(), None, NOW.replace(hour=12))
+
+
+@pytest.mark.parametrize('stats, maintenance_state, expected', [
+    (make_stats(), {}, True),
+    (make_stats(table_rows=2000), {'last_analyzed_at': '2024-05-31T12:00:00', 'analyzed_rows': 1000}, False),
+    (make_stats(table_rows=1050), {'last_analyzed_at': '2024-05-30T00:00:00', 'analyzed_rows': 1000}, False),
+    (make_stats(table_rows=1200), {'last_analyzed_at': '2024-05-30T00:00:00', 'analyzed_rows': 1000}, True),
+    (None, {'last_analyzed_at': '2024-05-30T00:00:00', 'analyzed_rows': 1000}, True),
+], ids=['never-analyzed', 'too-soon', 'few-changed-rows', 'many-changed-rows', 'no-stats'])
+def test_analyze_by_interval_and_changed_rows(stats, maintenance_state, expected):
+    assert should_analyze_table(stats, maintenance_state, NOW) is expected